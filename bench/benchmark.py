@@ -0,0 +1,220 @@
+"""
+End-to-end throughput benchmark against the local fake API.
+
+Run from the repository root:
+
+    python -m bench.benchmark --latency 0.05 --scenarios randeezer create_playlists unheard
+"""
+import argparse
+import contextlib
+import csv
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+if '--verbose' not in sys.argv:
+    os.environ.setdefault('TQDM_DISABLE', '1')
+
+from bench.fake_api import FakeApiConfig, FakeApiServer, FakeLibrary
+from main import DeezerFavoritesAnalyzer, LastFmClient
+from matching import FuzzyIndex
+from normalize import canonical_key
+from profiling import StageProfiler
+from pydeez import PyDeez, RequestMetrics
+from pydeez.rate_limit import RateLimiter
+from pydeez.transport import HttpTransport
+import randeezer
+
+
+SCENARIOS = ['randeezer', 'create_playlists', 'pipelined', 'lastfm', 'unheard']
+
+# Share of the fuzzy index a lookup may have to score before the benchmark warns
+MAX_SHORTLIST_FRACTION = 0.05
+
+
+def _write_scrobble_csv(library: FakeLibrary, path: str):
+    """Write the library's scrobbles in the lastfm-to-csv export format (artist, album, track, date)."""
+    with open(path, 'w', newline='', encoding='latin-1') as f:
+        writer = csv.writer(f)
+        for uts, track_id in library.scrobbles:
+            track = library.tracks[track_id]
+            played_at = time.strftime('%d %b %Y %H:%M', time.gmtime(uts))
+            writer.writerow([track['artist']['name'], track['album']['title'], track['title'], played_at])
+
+
+def check_shortlist(library: FakeLibrary, threshold: int = 85):
+    """
+    Measure how much of the listened-track index a favorite is scored against.
+
+    Args:
+        library: Library whose favourites are looked up among its scrobbled tracks
+        threshold: Similarity threshold of the index
+
+    Returns:
+        Result dictionary with the mean shortlist size and its fraction of the index
+    """
+    def key(track_id):
+        track = library.tracks[track_id]
+        return canonical_key(track['artist']['name'], track['title'])
+
+    listened = sorted({key(track_id) for _, track_id in library.scrobbles})
+    index = FuzzyIndex(threshold, corpus=listened)
+    for identifier in listened:
+        index.add(identifier)
+
+    started = time.perf_counter()
+    shortlists = [len(index.candidates(key(track_id))) for track_id in library.favourites]
+    mean_shortlist = sum(shortlists) / len(shortlists) if shortlists else 0.0
+    fraction = mean_shortlist / len(index) if len(index) else 0.0
+    return {
+        'scenario': 'shortlist',
+        'wall_time': time.perf_counter() - started,
+        'lookups': len(shortlists),
+        'index_size': len(index),
+        'mean_shortlist': mean_shortlist,
+        'fraction': fraction,
+        'ok': fraction <= MAX_SHORTLIST_FRACTION
+    }
+
+
+def run_scenarios(server: FakeApiServer, scenarios, client_rate: float, verbose: bool = False):
+    """
+    Run the selected scenarios against a started fake server.
+
+    Args:
+        server: Running FakeApiServer
+        scenarios: Names of the scenarios to run, in order
+        client_rate: Requests per second the client-side rate limiter allows
+        verbose: Show the output of the code under test
+
+    Returns:
+        List of result dictionaries, one per scenario
+    """
+    host_limit = (client_rate, max(1, int(client_rate)))
+    metrics = RequestMetrics()
+    transport = HttpTransport(rate_limiter=RateLimiter(default_limit=host_limit), metrics=metrics)
+    pydeez = PyDeez('fake-token', transport=transport, base_url=server.base_url)
+    cache_dir = tempfile.mkdtemp(prefix='bench-cache-')
+    lastfm = LastFmClient('fake-key', 'bench', cache_dir, transport=transport, base_url=server.lastfm_url)
+    csv_path = os.path.join(cache_dir, 'scrobbles.csv')
+    _write_scrobble_csv(server.library, csv_path)
+
+    state = {}
+
+    def run_randeezer():
+        state['tracks'] = randeezer.randeezer(pydeez, ['source'])
+        return len(state['tracks'])
+
+    def run_create_playlists():
+        tracks = state.get('tracks') or randeezer.randeezer(pydeez, ['source'])
+        pydeez.create_playlists(tracks, 'bench')
+        return len(tracks)
+
+    def run_pipelined():
+        randeezer.randeezer_pipelined(pydeez, ['source'], 'bench-pipelined', ['favourite', 'nope'],
+                                      include_favourites=True)
+        return sum(len(playlist['tracks']) for playlist_id, playlist in server.library.playlists.items()
+                   if playlist['title'].startswith('bench-pipelined'))
+
+    def run_lastfm():
+        return len(lastfm.get_tracks_listened_to_past_year())
+
+    def run_unheard():
+        analyzer = DeezerFavoritesAnalyzer(pydeez, lastfm, cache_dir, profiler=StageProfiler())
+        analyzer.create_unheard_favorites_playlist('bench-unheard', csv_path=csv_path)
+        state['stages'] = analyzer.profiler.report()
+        return len(server.library.favourites)
+
+    runners = {
+        'randeezer': run_randeezer,
+        'create_playlists': run_create_playlists,
+        'pipelined': run_pipelined,
+        'lastfm': run_lastfm,
+        'unheard': run_unheard
+    }
+
+    results = []
+    for name in scenarios:
+        server.reset_counts()
+        metrics.reset()
+        output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+        started = time.perf_counter()
+        with output:
+            items = runners[name]()
+        wall_time = time.perf_counter() - started
+        summary = metrics.snapshot()['summary']
+        results.append({
+            'scenario': name,
+            'wall_time': wall_time,
+            'requests': server.total_requests,
+            'requests_per_second': server.total_requests / wall_time if wall_time else 0.0,
+            'items': items,
+            'request_time': summary['request_time'],
+            'throttle_sleep': summary['throttle_sleep'],
+            'cpu_time': summary['cpu_time'],
+            'bytes_in': summary['bytes_in'],
+            'endpoints': dict(server.request_counts),
+            'stages': state.pop('stages', [])
+        })
+    results.append({'scenario': 'connection_pool', **transport.pool_stats()})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--tracks', type=int, default=20000, help='catalogue size')
+    parser.add_argument('--playlists', type=int, default=10, help='number of source playlists')
+    parser.add_argument('--playlist-size', type=int, default=1500)
+    parser.add_argument('--favourites', type=int, default=3000)
+    parser.add_argument('--scrobbles', type=int, default=20000)
+    parser.add_argument('--latency', type=float, default=0.0, help='server latency per request in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='extra random latency in seconds')
+    parser.add_argument('--server-rate-limit', type=int, default=0,
+                        help='requests per window before the server returns quota errors (0 disables)')
+    parser.add_argument('--rate-window', type=float, default=5.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='probability of an injected HTTP 500')
+    parser.add_argument('--page-size', type=int, default=2000)
+    parser.add_argument('--max-songs-per-request', type=int, default=100)
+    parser.add_argument('--client-rate', type=float, default=1000.0, help='client-side requests per second')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    parser.add_argument('--verbose', action='store_true', help='show output of the code under test')
+    args = parser.parse_args()
+
+    library = FakeLibrary(track_count=args.tracks, playlist_count=args.playlists,
+                          playlist_size=args.playlist_size, favourite_count=args.favourites,
+                          scrobble_count=args.scrobbles)
+    config = FakeApiConfig(latency=args.latency, jitter=args.jitter, rate_limit=args.server_rate_limit,
+                           rate_window=args.rate_window, error_rate=args.error_rate, page_size=args.page_size,
+                           max_songs_per_request=args.max_songs_per_request)
+
+    with FakeApiServer(library, config) as server:
+        results = run_scenarios(server, args.scenarios, args.client_rate, args.verbose)
+    results.append(check_shortlist(library))
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+        return
+
+    for result in results:
+        if result['scenario'] == 'connection_pool':
+            print(f"{'connection pool':<18} {result['requests']:>7} requests over "
+                  f"{result['connections']} connections ({result['reused']} reused)")
+        elif result['scenario'] == 'shortlist':
+            print(f"{'fuzzy shortlist':<18} {result['wall_time']:>8.2f}s {result['lookups']:>7} lookups "
+                  f"{result['mean_shortlist']:>9.1f} of {result['index_size']} entries "
+                  f"({result['fraction']:.2%}){'' if result['ok'] else ' WARNING: shortlists are too large'}")
+        else:
+            print(f"{result['scenario']:<18} {result['wall_time']:>8.2f}s {result['requests']:>7} requests "
+                  f"{result['requests_per_second']:>9.1f} req/s {result['items']:>8} items "
+                  f"(throttled {result['throttle_sleep']:.2f}s, cpu {result['cpu_time']:.2f}s)")
+            for stage in result['stages']:
+                print(f"  {stage['stage']:<16} {stage['wall_time']:>8.2f}s {stage['items']:>16} items "
+                      f"{stage['fuzzy_comparisons']:>10} fuzzy comparisons")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+import json
+import random
+import socket
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+
+class FakeApiConfig:
+    """Behaviour knobs for the fake Deezer/Last.fm server."""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, rate_limit: int = 0,
+                 rate_window: float = 5.0, error_rate: float = 0.0, page_size: int = 2000,
+                 max_songs_per_request: int = 100):
+        """
+        Args:
+            latency: Seconds added to every response
+            jitter: Maximum random seconds added on top of the latency
+            rate_limit: Requests allowed per rate_window before quota errors (0 disables)
+            rate_window: Length of the rate limit window in seconds
+            error_rate: Probability (0-1) of answering with an HTTP 500
+            page_size: Maximum number of items per page
+            max_songs_per_request: Largest batch of songs a playlist write accepts
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.error_rate = error_rate
+        self.page_size = page_size
+        self.max_songs_per_request = max_songs_per_request
+
+
+class FakeLibrary:
+    """In-memory state served by the fake API: tracks, playlists, favourites and scrobbles."""
+
+    def __init__(self, track_count: int = 20000, playlist_count: int = 10, playlist_size: int = 1500,
+                 favourite_count: int = 3000, scrobble_count: int = 20000, seed: int = 0):
+        """
+        Generate a random library.
+
+        Args:
+            track_count: Number of distinct tracks in the catalogue
+            playlist_count: Number of pre-existing playlists
+            playlist_size: Number of tracks in each pre-existing playlist
+            favourite_count: Number of favourite tracks
+            scrobble_count: Number of scrobbles in the past year
+            seed: Random seed, so runs are comparable
+        """
+        rng = random.Random(seed)
+        self.lock = threading.Lock()
+        artists = [self._random_name(rng, 2) for _ in range(max(1, track_count // 20))]
+        albums = [self._random_name(rng, 3) for _ in range(max(1, track_count // 10))]
+        self.tracks = {}
+        for track_id in range(1, track_count + 1):
+            artist_id = rng.randrange(len(artists))
+            album_id = rng.randrange(len(albums))
+            self.tracks[track_id] = {
+                'id': track_id,
+                'title': self._random_name(rng, rng.randint(1, 4)),
+                'artist': {'id': artist_id + 1, 'name': artists[artist_id]},
+                'album': {'id': album_id + 1, 'title': albums[album_id]}
+            }
+        track_ids = list(self.tracks)
+        self.playlists = {}
+        self._next_playlist_id = 1
+        for i in range(playlist_count):
+            self.add_playlist(f"source-{i:02}", rng.sample(track_ids, min(playlist_size, track_count)))
+        self.favourites = rng.sample(track_ids, min(favourite_count, track_count))
+
+        now = int(time.time())
+        self.scrobbles = sorted(
+            ((now - rng.randrange(365 * 24 * 60 * 60), rng.choice(track_ids)) for _ in range(scrobble_count)),
+            reverse=True)
+
+    @staticmethod
+    def _random_name(rng, word_count):
+        syllables = ['ka', 'lo', 'mi', 'ra', 'sun', 'vel', 'dor', 'ix', 'bel', 'tor', 'na', 'qu', 'zen', 'fy']
+        return ' '.join(''.join(rng.choice(syllables) for _ in range(rng.randint(1, 3))).capitalize()
+                        for _ in range(word_count))
+
+    def add_playlist(self, title, track_ids=()):
+        playlist_id = self._next_playlist_id
+        self._next_playlist_id += 1
+        self.playlists[playlist_id] = {'id': playlist_id, 'title': title, 'tracks': list(track_ids)}
+        return playlist_id
+
+    def playlist_json(self, playlist_id):
+        playlist = self.playlists[playlist_id]
+        return {'id': playlist_id, 'title': playlist['title'], 'nb_tracks': len(playlist['tracks'])}
+
+
+class FakeApiServer:
+    """
+    Local stand-in for the parts of the Deezer and Last.fm APIs used by PyDeez and LastFmClient.
+
+    Deezer endpoints are served from the root (pass base_url to PyDeez), Last.fm
+    from /2.0/ (pass lastfm_url to LastFmClient).
+    """
+
+    def __init__(self, library: FakeLibrary = None, config: FakeApiConfig = None, port: int = 0):
+        """
+        Args:
+            library: Library to serve; a default random one is generated if omitted
+            config: Latency, rate limit and error injection settings
+            port: Port to listen on (0 picks a free one)
+        """
+        self.library = library or FakeLibrary()
+        self.config = config or FakeApiConfig()
+        self.request_counts = Counter()
+        self._recent_requests = deque()
+        self._counter_lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    @property
+    def lastfm_url(self) -> str:
+        return f"{self.base_url}/2.0/"
+
+    @property
+    def total_requests(self) -> int:
+        return sum(self.request_counts.values())
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset_counts(self):
+        with self._counter_lock:
+            self.request_counts.clear()
+
+    def _over_rate_limit(self):
+        if not self.config.rate_limit:
+            return False
+        with self._counter_lock:
+            now = time.monotonic()
+            while self._recent_requests and now - self._recent_requests[0] > self.config.rate_window:
+                self._recent_requests.popleft()
+            if len(self._recent_requests) >= self.config.rate_limit:
+                return True
+            self._recent_requests.append(now)
+            return False
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(_FakeApiHandler):
+            api = server
+
+        return Handler
+
+
+class _FakeApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    api = None
+
+    def setup(self):
+        super().setup()
+        # Headers and body go out in separate writes; don't let Nagle delay the body
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def _handle(self, method):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        body_length = int(self.headers.get('Content-Length') or 0)
+        if body_length:
+            # Form-encoded body parameters, as Deezer accepts for long values like order
+            form = parse_qs(self.rfile.read(body_length).decode())
+            params.update({key: values[0] for key, values in form.items()})
+        parts = [part for part in url.path.split('/') if part]
+        is_lastfm = parts[:1] == ['2.0']
+        endpoint = 'lastfm:' + params.get('method', '') if is_lastfm else self._endpoint_name(method, parts)
+
+        with self.api._counter_lock:
+            self.api.request_counts[endpoint] += 1
+
+        config = self.api.config
+        delay = config.latency + random.uniform(0, config.jitter)
+        if delay:
+            time.sleep(delay)
+
+        if config.error_rate and random.random() < config.error_rate:
+            return self._send(500, {'error': 'injected failure'})
+
+        if self.api._over_rate_limit():
+            if is_lastfm:
+                return self._send(200, {'error': 29, 'message': 'Rate Limit Exceeded'})
+            return self._send(200, {'error': {'type': 'Exception', 'message': 'Quota limit exceeded', 'code': 4}})
+
+        try:
+            with self.api.library.lock:
+                if is_lastfm:
+                    body = self._recent_tracks(params)
+                else:
+                    body = self._deezer(method, parts, params)
+        except (KeyError, ValueError):
+            body = {'error': {'type': 'DataException', 'message': 'no data', 'code': 800}}
+        self._send(200, body)
+
+    @staticmethod
+    def _endpoint_name(method, parts):
+        return method + ' /' + '/'.join('{id}' if part.isdigit() else part for part in parts)
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _deezer(self, method, parts, params):
+        library = self.api.library
+        if parts == ['user', 'me', 'playlists']:
+            if method == 'POST':
+                return {'id': library.add_playlist(params['title'])}
+            return self._page([library.playlist_json(playlist_id) for playlist_id in library.playlists], params)
+
+        if parts == ['user', 'me', 'tracks']:
+            return self._page([library.tracks[track_id] for track_id in library.favourites], params)
+
+        if len(parts) >= 2 and parts[0] == 'playlist':
+            playlist_id = int(parts[1])
+            playlist = library.playlists[playlist_id]
+
+            if len(parts) == 2:
+                if method == 'DELETE':
+                    del library.playlists[playlist_id]
+                    return True
+                return library.playlist_json(playlist_id)
+
+            if parts[2] == 'tracks':
+                if method == 'GET':
+                    return self._page([library.tracks[track_id] for track_id in playlist['tracks']], params)
+
+                song_ids = [int(song_id) for song_id in params.get('songs', '').split(',') if song_id]
+                if method == 'DELETE':
+                    playlist['tracks'] = [track_id for track_id in playlist['tracks'] if track_id not in song_ids]
+                    return True
+                if 'order' in params:
+                    order = [int(song_id) for song_id in params['order'].split(',') if song_id]
+                    if sorted(order) != sorted(playlist['tracks']):
+                        raise ValueError('order must list every track in the playlist')
+                    playlist['tracks'] = order
+                    return True
+                if len(song_ids) > self.api.config.max_songs_per_request:
+                    return {'error': {'type': 'Exception', 'message': 'Too many songs', 'code': 500}}
+                existing = set(playlist['tracks'])
+                playlist['tracks'].extend(track_id for track_id in song_ids
+                                          if track_id in library.tracks and track_id not in existing)
+                return True
+
+        raise KeyError(parts)
+
+    def _page(self, items, params):
+        index = int(params.get('index', 0))
+        limit = min(int(params.get('limit', 25)), self.api.config.page_size)
+        page = {'data': items[index:index + limit], 'total': len(items)}
+        if index + limit < len(items):
+            next_params = {'index': index + limit, 'limit': limit}
+            page['next'] = f"{self.api.base_url}{urlparse(self.path).path}?{urlencode(next_params)}"
+        return page
+
+    def _recent_tracks(self, params):
+        library = self.api.library
+        start = int(params.get('from', 0))
+        end = int(params.get('to', 2 ** 62))
+        limit = min(int(params.get('limit', 50)), 200)
+        page_number = int(params.get('page', 1))
+
+        scrobbles = [(uts, track_id) for uts, track_id in library.scrobbles if start <= uts <= end]
+        total_pages = max(1, -(-len(scrobbles) // limit))
+        page = scrobbles[(page_number - 1) * limit:page_number * limit]
+        return {
+            'recenttracks': {
+                'track': [
+                    {
+                        'artist': {'#text': library.tracks[track_id]['artist']['name']},
+                        'name': library.tracks[track_id]['title'],
+                        'album': {'#text': library.tracks[track_id]['album']['title']},
+                        'date': {'uts': str(uts)}
+                    }
+                    for uts, track_id in page
+                ],
+                '@attr': {
+                    'page': str(page_number),
+                    'perPage': str(limit),
+                    'totalPages': str(total_pages),
+                    'total': str(len(scrobbles))
+                }
+            }
+        }
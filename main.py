@@ -1,17 +1,35 @@
-import requests
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import argparse
+import calendar
+import hashlib
 import json
+import logging
+import mmap
 import os
 import pickle
-from typing import Set
-from fuzzywuzzy import fuzz
+from typing import Optional, Set
 import csv
+from pydeez.job_journal import JobJournal
+from pydeez.metrics import RequestMetrics
+from pydeez.response_cache import ResponseCache
+from pydeez.transport import shared_transport
+from scrobble_store import ScrobbleStore
+from matching import ListenedTrackIndex, NearDuplicateClusterer, find_match_safely, match_tracks_parallel
+from profiling import StageProfiler
+
+logger = logging.getLogger(__name__)
 
 
 class LastFmClient:
     """Client for interacting with the Last.fm API."""
 
-    def __init__(self, api_key: str, username: str, cache_dir: str = "cache"):
+    DAY = 24 * 60 * 60
+    PAGE_FETCH_ATTEMPTS = 3
+
+    def __init__(self, api_key: str, username: str, cache_dir: str = "cache", transport=None,
+                 base_url: str = "http://ws.audioscrobbler.com/2.0/", page_workers: int = 4,
+                 retention_days: Optional[int] = None):
         """
         Initialize the Last.fm API client.
 
@@ -19,138 +37,254 @@ class LastFmClient:
             api_key: Last.fm API key
             username: Last.fm username
             cache_dir: Directory to store cache files
+            transport: HttpTransport to send requests through (shared with PyDeez by default)
+            base_url: Root URL of the Last.fm API
+            page_workers: Number of pages fetched concurrently
+            retention_days: Drop scrobbles older than this many days (None keeps all)
         """
+        self.transport = transport or shared_transport()
         self.api_key = api_key
         self.username = username
-        self.base_url = "http://ws.audioscrobbler.com/2.0/"
+        self.base_url = base_url
+        self.page_workers = page_workers
+        self.retention_days = retention_days
         self.cache_dir = cache_dir
 
         # Create cache directory if it doesn't exist
         if not os.path.exists(cache_dir):
             os.makedirs(cache_dir)
 
+        self.store = ScrobbleStore(os.path.join(cache_dir, f"lastfm_scrobbles_{username}.sqlite"))
+
     def get_tracks_listened_to_past_year(self) -> Set[str]:
         """
         Get all tracks the user has listened to in the past year.
-        Uses caching to avoid refetching data.
 
         Returns:
             A set of strings in the format "artist - track" for all tracks listened to
         """
-        cache_file = os.path.join(self.cache_dir, f"lastfm_tracks_{self.username}.pkl")
+        return self.get_tracks_listened_to(365)
 
-        # Try to load from cache first
-        if os.path.exists(cache_file):
-            try:
-                with open(cache_file, 'rb') as f:
-                    cache_data = pickle.load(f)
-                    timestamp = cache_data.get('timestamp', 0)
-                    all_tracks = cache_data.get('tracks', set())
+    def get_tracks_listened_to(self, window_days: int, normalized: bool = False) -> Set[str]:
+        """
+        Get all tracks the user has listened to in the past window_days days.
+        Scrobbles are kept in a local store, so only ones not synced before are fetched.
 
-                    # If cache is less than 1 day old, use it
-                    if time.time() - timestamp < 24 * 60 * 60:
-                        print(f"Using cached Last.fm data with {len(all_tracks)} tracks")
-                        return all_tracks
-                    else:
-                        print("Cache is older than 24 hours, refreshing data...")
-            except Exception as e:
-                print(f"Error loading cache: {e}")
+        Args:
+            window_days: Size of the window in days
+            normalized: Return lowercased keys instead of the names as scrobbled
 
-        print("Fetching tracks listened to in the past year from Last.fm...")
+        Returns:
+            A set of strings in the format "artist - track" for all tracks listened to
+        """
+        since = int(time.time()) - window_days * self.DAY
+        self.sync_scrobbles(since)
+        if normalized:
+            all_tracks = self.store.track_keys_played_since(since)
+        else:
+            all_tracks = self.store.tracks_played_since(since)
+
+        print(f"Found {len(all_tracks)} unique tracks listened to in the past {window_days} days")
+        return all_tracks
+
+    def sync_scrobbles(self, since: int) -> bool:
+        """
+        Make sure the local store holds every scrobble from a timestamp until now.
 
-        # Set to store all tracks
-        all_tracks = set()
+        The store remembers the time range it has fully synced. Only the parts of the requested
+        range outside it are fetched: older scrobbles once when the window grows, and newer
+        ones on every sync. An interrupted sync is resumed first.
+
+        Args:
+            since: Unix timestamp the store has to cover from
+
+        Returns:
+            True if the store is complete for the range, False if a sync was interrupted
+        """
+        pending_sync = self.store.get_meta('pending_sync')
+        if pending_sync:
+            print(f"Resuming the interrupted Last.fm sync ({len(pending_sync['pages_done'])} pages already fetched)...")
+            if not self._sync_range(pending_sync):
+                return False
 
-        # Get the current timestamp and calculate one year ago
         current_time = int(time.time())
-        one_year_ago = current_time - (365 * 24 * 60 * 60)
+        synced_range = self.store.get_meta('synced_range')
+        if synced_range is None:
+            print("Fetching tracks listened to from Last.fm...")
+            ranges = [(since, current_time)]
+        else:
+            print(f"Fetching scrobbles since the last sync ({len(self.store)} stored)...")
+            synced_from, synced_to = synced_range
+            ranges = [(since, synced_from - 1), (synced_to + 1, current_time)]
+
+        for range_from, range_to in ranges:
+            if range_from > range_to:
+                continue
+            if not self._sync_range({'from': range_from, 'to': range_to, 'total_pages': None, 'pages_done': []}):
+                return False
+
+        if self.retention_days is not None:
+            self._prune(current_time - self.retention_days * self.DAY)
+        return True
+
+    def _sync_range(self, sync) -> bool:
+        """
+        Fetch every scrobble in a time range into the store.
+
+        Once the first page reports the page count, the remaining pages are fetched
+        concurrently. The sync state is saved after every page, so an interrupted sync
+        resumes from the pages it is missing.
+
+        Args:
+            sync: Dictionary with 'from' and 'to' timestamps, 'total_pages' (None until known)
+                and the list of 'pages_done'
 
-        # Initial parameters
+        Returns:
+            True if every page of the range was stored
+        """
+        self.store.set_meta('pending_sync', sync)
+
+        # 'to' is pinned so pages don't shift while new scrobbles come in
         params = {
             'method': 'user.getrecenttracks',
             'user': self.username,
             'api_key': self.api_key,
             'format': 'json',
             'limit': 200,  # Maximum allowed by Last.fm API
-            'from': one_year_ago,
-            'page': 1
+            'from': sync['from'],
+            'to': sync['to']
         }
 
-        total_pages = 1  # Will be updated with the first API call
-        current_page = 1
-
         try:
-            while current_page <= total_pages:
-                params['page'] = current_page
+            if sync['total_pages'] is None:
+                total_pages, scrobbles = self._fetch_scrobble_page(params, 1)
+                sync['total_pages'] = total_pages
+                self._store_scrobble_page(sync, 1, scrobbles)
+
+            missing_pages = [page for page in range(1, sync['total_pages'] + 1) if page not in sync['pages_done']]
+            for _ in range(self.PAGE_FETCH_ATTEMPTS):
+                if not missing_pages:
+                    break
+                missing_pages = self._fetch_scrobble_pages(params, missing_pages, sync)
+        except Exception as e:
+            print(f"Error occurred while fetching Last.fm data: {e}")
 
-                # Make the API request
-                response = requests.get(self.base_url, params=params)
-                data = response.json()
+        if sync['total_pages'] is None or len(sync['pages_done']) < sync['total_pages']:
+            print(f"Last.fm sync incomplete ({len(sync['pages_done'])}/{sync['total_pages'] or '?'} pages); "
+                  "the next run resumes from the missing pages")
+            return False
 
-                # Check if the request was successful
-                if 'recenttracks' not in data:
-                    print(f"Error fetching tracks from Last.fm: {data}")
-                    break
+        # Ranges are synced adjacent to the already synced one, so the union stays contiguous
+        synced_range = self.store.get_meta('synced_range')
+        if synced_range is not None:
+            synced_range = [min(synced_range[0], sync['from']), max(synced_range[1], sync['to'])]
+        self.store.set_meta('synced_range', synced_range or [sync['from'], sync['to']])
+        self.store.set_meta('pending_sync', None)
+        return True
 
-                # Update total pages
-                total_pages = int(data['recenttracks']['@attr']['totalPages'])
+    def _store_scrobble_page(self, sync, page: int, scrobbles: Set[tuple]):
+        """
+        Add a fetched page to the store and record it in the sync state.
 
-                # Process tracks
-                tracks = data['recenttracks']['track']
-                for track in tracks:
-                    # Skip currently playing track (it doesn't have a date)
-                    if '@attr' in track and track['@attr'].get('nowplaying') == 'true':
-                        continue
+        Args:
+            sync: Sync state of the range being fetched
+            page: Page number
+            scrobbles: Scrobbles on the page
+        """
+        self.store.add(scrobbles)
+        sync['pages_done'].append(page)
+        self.store.set_meta('pending_sync', sync)
+        print(f"Processed page {page}/{sync['total_pages']} ({len(sync['pages_done'])} pages so far)")
 
-                    artist_name = track['artist']['#text']
-                    track_name = track['name']
-                    track_identifier = f"{artist_name} - {track_name}"
-                    all_tracks.add(track_identifier)
+    def _prune(self, before: int):
+        """
+        Drop scrobbles older than the retention period.
 
-                # Save progress to cache after each page (in case of error)
-                if current_page % 5 == 0 or current_page == total_pages:
-                    self._save_tracks_cache(all_tracks)
+        Args:
+            before: Unix timestamp; older scrobbles are removed
+        """
+        self.store.prune(before)
+        synced_range = self.store.get_meta('synced_range')
+        if synced_range is not None and synced_range[0] < before:
+            self.store.set_meta('synced_range', [before, synced_range[1]])
 
-                print(f"Processed page {current_page}/{total_pages} ({len(all_tracks)} unique tracks so far)")
-                current_page += 1
+    def _fetch_scrobble_page(self, params, page: int):
+        """
+        Fetch one page of recent tracks.
 
-                # Respect Last.fm API rate limits (5 requests per second)
-                if current_page <= total_pages:
-                    time.sleep(0.2)
+        Args:
+            params: user.getrecenttracks parameters without the page
+            page: Page number, starting at 1
 
-        except Exception as e:
-            print(f"Error occurred while fetching Last.fm data: {e}")
-            print("Using partial data collected so far")
+        Returns:
+            Tuple of (total number of pages, set of scrobbles on the page)
+        """
+        data = self.transport.get(self.base_url, params={**params, 'page': page}).json()
 
-        # Save final results to cache
-        self._save_tracks_cache(all_tracks)
+        # Check if the request was successful
+        if 'recenttracks' not in data:
+            raise ValueError(f"Error fetching tracks from Last.fm: {data}")
 
-        print(f"Found {len(all_tracks)} unique tracks listened to in the past year")
-        return all_tracks
+        return int(data['recenttracks']['@attr']['totalPages']), self._parse_scrobbles(data['recenttracks']['track'])
 
-    def _save_tracks_cache(self, tracks: Set[str]):
+    def _fetch_scrobble_pages(self, params, page_numbers, sync):
         """
-        Save fetched tracks to cache file.
+        Fetch pages concurrently on a bounded pool; the transport's rate limiter paces the requests.
 
         Args:
-            tracks: Set of track identifiers
+            params: user.getrecenttracks parameters without the page
+            page_numbers: Pages to fetch
+            sync: Sync state of the range, updated as pages arrive
+
+        Returns:
+            Sorted list of the pages that failed
         """
-        cache_file = os.path.join(self.cache_dir, f"lastfm_tracks_{self.username}.pkl")
-        try:
-            with open(cache_file, 'wb') as f:
-                cache_data = {
-                    'timestamp': time.time(),
-                    'tracks': tracks
-                }
-                pickle.dump(cache_data, f)
-        except Exception as e:
-            print(f"Warning: Could not save cache: {e}")
+        failed_pages = []
+        with ThreadPoolExecutor(max_workers=self.page_workers) as executor:
+            futures = {executor.submit(self._fetch_scrobble_page, params, page): page for page in page_numbers}
+            for future in as_completed(futures):
+                page = futures[future]
+                try:
+                    _, scrobbles = future.result()
+                except Exception as e:
+                    print(f"Error fetching page {page}: {e}")
+                    failed_pages.append(page)
+                    continue
+                self._store_scrobble_page(sync, page, scrobbles)
+        return sorted(failed_pages)
+
+    @staticmethod
+    def _parse_scrobbles(tracks) -> Set[tuple]:
+        """
+        Convert a page of Last.fm recent tracks into scrobble tuples.
+
+        Args:
+            tracks: 'track' list of a user.getrecenttracks response
+
+        Returns:
+            A set of (timestamp, artist, track) tuples
+        """
+        scrobbles = set()
+        for track in tracks:
+            # Skip currently playing track (it doesn't have a date)
+            if '@attr' in track and track['@attr'].get('nowplaying') == 'true':
+                continue
+
+            scrobbles.add((int(track['date']['uts']), track['artist']['#text'], track['name']))
+        return scrobbles
 
 
 class DeezerFavoritesAnalyzer:
     """Class to analyze Deezer favorites and create playlists of unheard favorites."""
 
-    def __init__(self, deezer_client, lastfm_client, cache_dir: str = "cache"):
+    CSV_MONTHS = {month: number for number, month in enumerate(
+        ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'), 1)}
+    CSV_CHUNK_SIZE = 4 * 1024 * 1024
+    # Bumped when the rows an import stores change, so older stores are rebuilt
+    CSV_IMPORT_VERSION = 2
+
+    def __init__(self, deezer_client, lastfm_client, cache_dir: str = "cache", match_workers: int = 1,
+                 profiler: Optional[StageProfiler] = None):
         """
         Initialize with Deezer and Last.fm clients.
 
@@ -158,15 +292,21 @@ class DeezerFavoritesAnalyzer:
             deezer_client: Your existing Deezer API client
             lastfm_client: The Last.fm API client
             cache_dir: Directory to store cache files
+            match_workers: Number of processes used to match favorites against listened tracks
+            profiler: StageProfiler measuring each stage of the pipeline (a default one if not given)
         """
         self.deezer = deezer_client
         self.lastfm = lastfm_client
         self.cache_dir = cache_dir
+        self.match_workers = match_workers
+        self.profiler = profiler or StageProfiler()
 
         # Create cache directory if it doesn't exist
         if not os.path.exists(cache_dir):
             os.makedirs(cache_dir)
 
+        self.journal = JobJournal(os.path.join(cache_dir, "unheard_favorites_journal.jsonl"))
+
     def _get_favorite_tracks(self):
         """
         Get all favorite tracks from Deezer with caching support.
@@ -277,88 +417,239 @@ class DeezerFavoritesAnalyzer:
             except:
                 return "Unknown Artist", "Unknown Track", 0
 
-    def load_listened_tracks_from_csv(self) -> set[str]:
+    def load_listened_tracks_from_csv(self, file_path: Optional[str] = None,
+                                      window_days: Optional[int] = None) -> set[str]:
         """
-        Prompts for a CSV file path and loads listened tracks as 'artist - track' strings.
+        Loads listened tracks from a CSV file as normalized 'artist - track' keys, prompting for the path if not given.
 
         Assumes:
         - No header row
         - Column A = artist (index 0)
         - Column C = track  (index 2)
+        - Column D = date played, e.g. "31 Jan 2024 18:05" in UTC (index 3)
+
+        The rows are imported into a local scrobble store so any listening window can be
+        answered from it. The store remembers the size, modification time and hash of the
+        file it was built from, so an unchanged export is not parsed again. Rows without a
+        readable date count as played when the file was written.
+
+        Args:
+            file_path: Path to the CSV file
+            window_days: Only return tracks played in the past window_days days (None returns all)
 
         Returns:
-            A set of "artist - track" strings
+            A set of lowercased "artist - track" keys
         """
-        file_path = input("Paste the full Windows path to your CSV file: ").strip('"')
+        if file_path is None:
+            file_path = input("Paste the full Windows path to your CSV file: ").strip('"')
 
         if not os.path.isfile(file_path):
             raise FileNotFoundError(f"File not found: {file_path}")
 
-        listened_tracks = set()
-        with open(file_path, 'r', encoding='latin-1') as f:
-            reader = csv.reader(f)
-            for row in reader:
-                if len(row) >= 3:
-                    artist = row[0].strip()
-                    track = row[2].strip()
-                    if artist and track:
-                        listened_tracks.add(f"{artist} - {track}")
+        store = ScrobbleStore(os.path.join(self.cache_dir, "csv_scrobbles.sqlite"))
+        try:
+            self._import_csv(store, file_path)
+            since = int(time.time()) - window_days * LastFmClient.DAY if window_days is not None else None
+            listened_tracks = store.track_keys_played_since(since)
+        finally:
+            store.close()
+
         print(f"Loaded {len(listened_tracks)} listened tracks from CSV")
         return listened_tracks
 
-    def create_unheard_favorites_playlist(self, playlist_name: str = "Favorites Not Played in a Year") -> str:
+    def _import_csv(self, store: ScrobbleStore, file_path: str):
+        """
+        Import a CSV export into the store unless the store was already built from the same file.
+
+        Every play is stored, so play counts and last-played times are as complete as the export.
+
+        Args:
+            store: Scrobble store to fill
+            file_path: Path to the CSV file
+        """
+        stat = os.stat(file_path)
+        source = store.get_meta('source')
+        # Stores imported before every play was kept have no version and are rebuilt
+        if source and source.get('version') != self.CSV_IMPORT_VERSION:
+            source = None
+        if source and source['size'] == stat.st_size and source['mtime'] == stat.st_mtime_ns:
+            print(f"CSV unchanged since the last import ({len(store)} scrobbles)")
+            return
+
+        # A touched or copied export with the same contents doesn't need a new import either
+        file_hash = self._hash_file(file_path)
+        if source and source['size'] == stat.st_size and source['hash'] == file_hash:
+            print(f"CSV contents unchanged since the last import ({len(store)} scrobbles)")
+        else:
+            print("Importing CSV...")
+            store.replace(self._iter_csv_scrobbles(file_path, int(stat.st_mtime)))
+        store.set_meta('source', {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': file_hash,
+                                  'version': self.CSV_IMPORT_VERSION})
+
+    @staticmethod
+    def _hash_file(file_path: str) -> str:
+        """
+        Hash a file's contents.
+
+        Args:
+            file_path: Path to the file
+
+        Returns:
+            Hex digest of the contents
+        """
+        digest = hashlib.blake2b()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _iter_csv_scrobbles(self, file_path: str, default_played_at: int):
+        """
+        Stream the scrobbles of a CSV export from a memory map, without reading the file into memory.
+
+        Args:
+            file_path: Path to the CSV file
+            default_played_at: Timestamp used for rows without a readable date
+
+        Yields:
+            (timestamp, track key, artist, track) tuples, the key already normalized
+        """
+        if os.path.getsize(file_path) == 0:
+            return
+
+        # Many scrobbles share a day, so the calendar math runs once per day
+        day_starts = {}
+        track_key = ScrobbleStore.track_key
+        with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for row in csv.reader(self._iter_mapped_lines(mapped)):
+                if len(row) < 3:
+                    continue
+                artist = row[0].strip()
+                track = row[2].strip()
+                if not artist or not track:
+                    continue
+
+                played_at = default_played_at
+                if len(row) >= 4:
+                    # e.g. "31 Jan 2024 18:05" in UTC
+                    date, _, clock = row[3].strip().rpartition(' ')
+                    try:
+                        day_start = day_starts.get(date)
+                        if day_start is None:
+                            day_start = day_starts[date] = self._parse_csv_day(date)
+                        played_at = day_start + int(clock[:-3]) * 3600 + int(clock[-2:]) * 60
+                    except (ValueError, KeyError):
+                        pass
+                yield played_at, track_key(artist, track), artist, track
+
+    def _iter_mapped_lines(self, mapped):
+        """
+        Decode a memory-mapped file in large chunks and split it into lines.
+
+        Args:
+            mapped: Memory map of a latin-1 encoded file
+
+        Yields:
+            Lines including their line endings
+        """
+        partial_line = ''
+        for offset in range(0, len(mapped), self.CSV_CHUNK_SIZE):
+            # Only "\n" ends a line: str.splitlines would also split on characters like
+            # U+0085, which is how the "Å" of a UTF-8 name decodes as latin-1
+            lines = (partial_line + mapped[offset:offset + self.CSV_CHUNK_SIZE].decode('latin-1')).split('\n')
+            # The last line may continue in the next chunk
+            partial_line = lines.pop()
+            for line in lines:
+                yield line + '\n'
+        if partial_line:
+            yield partial_line
+
+    def _parse_csv_day(self, date: str) -> int:
+        """
+        Parse the day part of a CSV play time, such as "31 Jan 2024".
+
+        Args:
+            date: Day, month abbreviation and year
+
+        Returns:
+            Unix timestamp of the start of the day (UTC)
+        """
+        day, month, year = date.split()
+        return calendar.timegm((int(year), self.CSV_MONTHS[month], int(day), 0, 0, 0))
+
+    def create_unheard_favorites_playlist(self, playlist_name: str = "Favorites Not Played in a Year",
+                                          csv_path: Optional[str] = None, window_days: int = 365) -> str:
         """
-        Create a playlist of favorite tracks not listened to in the past year.
+        Create a playlist of favorite tracks not listened to in the past window_days days.
 
         Args:
             playlist_name: Name for the new playlist
+            csv_path: Path to the Last.fm CSV export (prompted for if not given)
+            window_days: Size of the listening window in days
 
         Returns:
             ID of the created playlist
         """
+        profiler = self.profiler
+
         # Get all favorite tracks from Deezer with caching
-        favorite_tracks = self._get_favorite_tracks()
+        with profiler.stage("fetch_favorites") as stage:
+            favorite_tracks = self._get_favorite_tracks()
+            stage["items"] = len(favorite_tracks)
         print(f"Found {len(favorite_tracks)} favorite tracks")
 
-        # Get all tracks listened to in the past year from Last.fm
+        # Get all tracks listened to in the window from Last.fm
         # Uncomment to get tracks from Lastfm
-        # recently_played_tracks = self.lastfm.get_tracks_listened_to_past_year()
+        # recently_played_tracks = self.lastfm.get_tracks_listened_to(window_days, normalized=True)
         # Use https://benjaminbenben.com/lastfm-to-csv/ if you want to get an updateds csv!
-        recently_played_tracks = self.load_listened_tracks_from_csv()
+        with profiler.stage("load_listened") as stage:
+            recently_played_tracks = self.load_listened_tracks_from_csv(csv_path, window_days)
+            stage["items"] = len(recently_played_tracks)
 
         # Create a set of unheard favorites
         unheard_favorites = []
         track_info_cache = {}  # Cache for track info
-        existing_artist_track_names = []
-
-        for track in favorite_tracks:
-            try:
-                # Extract track info safely
-                artist_name, track_name, track_id = self._extract_track_info(track)
-
-                # Store in cache for future use
-                track_info_cache[track_id] = (artist_name, track_name)
-
-                ARTIST_SIMILARITY_THRESHOLD = 90
-                TRACK_SIMILARITY_THRESHOLD = 90
-
-                # Check if track was recently played using fuzzy matching
-                if not self._is_track_recently_played(artist_name, track_name, recently_played_tracks):
-                    # Check for similarity with already-added tracks
-                    is_similar = any(
-                        fuzz.ratio(artist_name.lower(), existing_artist.lower()) >= ARTIST_SIMILARITY_THRESHOLD and
-                        fuzz.ratio(track_name.lower(), existing_track.lower()) >= TRACK_SIMILARITY_THRESHOLD
-                        for existing_artist, existing_track in existing_artist_track_names
-                    )
-
-                    if not is_similar:
-                        unheard_favorites.append((track, track_id))
-                        existing_artist_track_names.append((artist_name, track_name))
-            except Exception as e:
-                print(f"Error processing track: {e}")
-                continue
+        favorite_track_infos = []
 
-        print(f"Found {len(unheard_favorites)} favorite tracks not played in the past year")
+        with profiler.stage("extract") as stage:
+            for track in favorite_tracks:
+                try:
+                    # Extract track info safely
+                    artist_name, track_name, track_id = self._extract_track_info(track)
+
+                    # Store in cache for future use
+                    track_info_cache[track_id] = (artist_name, track_name)
+                    favorite_track_infos.append((track, artist_name, track_name, track_id))
+                except Exception as e:
+                    print(f"Error processing track: {e}")
+                    continue
+            stage["items"] = len(favorite_track_infos)
+
+        # Check which favorites were recently played using fuzzy matching
+        with profiler.stage("match") as stage:
+            matches = self._find_recently_played(
+                [(artist_name, track_name) for _, artist_name, track_name, _ in favorite_track_infos],
+                recently_played_tracks, normalized=True)
+            stage["items"] = len(matches)
+
+        ARTIST_SIMILARITY_THRESHOLD = 90
+        TRACK_SIMILARITY_THRESHOLD = 90
+        near_duplicates = NearDuplicateClusterer(
+            ARTIST_SIMILARITY_THRESHOLD, TRACK_SIMILARITY_THRESHOLD,
+            track_names=[track_name for _, _, track_name, _ in favorite_track_infos])
+
+        with profiler.stage("dedup") as stage:
+            for (track, artist_name, track_name, track_id), match in zip(favorite_track_infos, matches):
+                if match is not None:
+                    self._report_match(artist_name, track_name, match)
+                    continue
+
+                # Skip tracks similar to an already-added one
+                if near_duplicates.add(artist_name, track_name):
+                    unheard_favorites.append((track, track_id))
+            stage["items"] = len(unheard_favorites)
+
+        print(f"Found {len(unheard_favorites)} favorite tracks not played in the past {window_days} days")
 
         # Create a new playlist with these tracks
         if not unheard_favorites:
@@ -370,81 +661,72 @@ class DeezerFavoritesAnalyzer:
 
         # Save the track info cache
         cache_file = os.path.join(self.cache_dir, "track_info_cache.pkl")
-        try:
-            with open(cache_file, 'wb') as f:
-                pickle.dump(track_info_cache, f)
-        except Exception as e:
-            print(f"Warning: Could not save track info cache: {e}")
-
-        # Create the playlist and add tracks
-        print(f"Creating playlist '{playlist_name}' with {len(track_ids)} tracks")
-        new_playlist_id = self.deezer.create_playlist(playlist_name)
-
-        # Add tracks in chunks (Deezer API has limitations)
-        chunk_size = 50  # Deezer's limit for adding tracks in one request
-        track_id_chunks = self.deezer.chunkify(track_ids, chunk_size)
-
-        for i, chunk in enumerate(track_id_chunks):
-            print(f"Adding chunk {i + 1}/{len(track_id_chunks)} to playlist")
+        with profiler.stage("save_track_info") as stage:
             try:
-                string_track_ids = [str(track_id) for track_id in chunk]
-                self.deezer.add_tracks_to_playlist_by_track_ids(new_playlist_id, string_track_ids)
-                time.sleep(1)  # Respect API rate limits
+                with open(cache_file, 'wb') as f:
+                    pickle.dump(track_info_cache, f)
             except Exception as e:
-                print(f"Error adding chunk {i + 1}: {e}")
-                print("Continuing with next chunk...")
-                continue
+                print(f"Warning: Could not save track info cache: {e}")
+            stage["items"] = len(track_info_cache)
+
+        # Create the playlist and add tracks in adaptively sized batches, then verify it once.
+        # Every step is journaled, so an interrupted run can be finished with --resume.
+        print(f"Creating playlist '{playlist_name}' with {len(track_ids)} tracks")
+        with profiler.stage("write_playlist") as stage:
+            new_playlist_id, = self.deezer.write_playlists([(playlist_name, track_ids)], playlist_count=1,
+                                                           journal=self.journal, job=playlist_name)
+            stage["items"] = len(track_ids)
 
         print(f"Successfully created playlist '{playlist_name}' with {len(track_ids)} unheard favorites")
         return new_playlist_id
 
-    def _is_track_recently_played(self, artist_name: str, track_name: str,
-                                  recently_played_tracks: Set[str],
-                                  similarity_threshold: int = 85) -> bool:
+    def resume_unheard_favorites_playlist(self) -> Optional[str]:
+        """
+        Finish writing the playlist of an interrupted run from its journal.
+
+        Returns:
+            ID of the playlist, or None if there was nothing to resume
+        """
+        playlist_ids = self.deezer.resume_playlists(self.journal)
+        return playlist_ids[0] if playlist_ids else None
+
+    def _find_recently_played(self, tracks, recently_played_tracks: Set[str], normalized: bool = False):
         """
-        Check if a track was recently played using fuzzy matching.
+        Match favorites against the recently played tracks, in parallel if configured.
 
         Args:
-            artist_name: Name of the artist
-            track_name: Name of the track
+            tracks: List of (artist_name, track_name) pairs
             recently_played_tracks: Set of recently played tracks in "artist - track" format
-            similarity_threshold: Minimum similarity score (0-100) to consider a match
+            normalized: The recently played tracks are already lowercased keys
 
         Returns:
-            True if track was recently played, False otherwise
+            List with a TrackMatch, or None if not recently played, for each pair
         """
-        # Exact match check first (faster)
-        track_identifier = f"{artist_name} - {track_name}"
-        if track_identifier in recently_played_tracks:
-            return True
+        if self.match_workers > 1:
+            print(f"Matching {len(tracks)} favorites on {self.match_workers} processes...")
+            return match_tracks_parallel(tracks, recently_played_tracks, self.match_workers, normalized=normalized)
 
-        # Try fuzzy matching if no exact match
-        for recent_track in recently_played_tracks:
-            try:
-                # Calculate similarity ratio
-                similarity = fuzz.ratio(track_identifier.lower(), recent_track.lower())
-
-                # Check for high similarity
-                if similarity >= similarity_threshold:
-                    print(f"Fuzzy match: '{track_identifier}' ~ '{recent_track}' ({similarity}%)")
-                    return True
-
-                # Also try matching just the track name (ignoring artist differences)
-                # This helps with "feat." variations or slight artist name differences
-                recent_parts = recent_track.split(" - ", 1)
-                if len(recent_parts) > 1:
-                    recent_artist, recent_title = recent_parts
-
-                    # Check track title similarity
-                    title_similarity = fuzz.ratio(track_name.lower(), recent_title.lower())
-                    if title_similarity >= 90 and fuzz.ratio(artist_name.lower(), recent_artist.lower()) >= 70:
-                        print(f"Title match: '{track_name}' ~ '{recent_title}' ({title_similarity}%)")
-                        return True
-            except Exception as e:
-                # If any error in matching, be safe and skip this comparison
-                continue
+        # Build the candidate index once; every favorite is then only scored against a shortlist
+        listened_index = ListenedTrackIndex(recently_played_tracks, normalized=normalized)
+        return [find_match_safely(listened_index, artist_name, track_name) for artist_name, track_name in tracks]
 
-        return False
+    @staticmethod
+    def _report_match(artist_name: str, track_name: str, match):
+        """
+        Log how a favorite was matched to a recently played track, at debug level.
+
+        Args:
+            artist_name: Name of the artist
+            track_name: Name of the track
+            match: TrackMatch found for the track
+        """
+        # Called once per matched favorite, so the message is only formatted when it will be shown
+        if match.kind == 'fuzzy':
+            logger.debug("Fuzzy match: '%s - %s' ~ '%s' (%s%%)", artist_name, track_name, match.listened, match.score)
+        elif match.kind == 'title':
+            logger.debug("Title match: '%s' ~ '%s' (%s%%)", track_name, match.listened, match.score)
+        elif match.kind == 'canonical':
+            logger.debug("Canonical match: '%s - %s' = '%s'", artist_name, track_name, match.listened)
 
 
 def load_config():
@@ -459,7 +741,11 @@ def load_config():
         "deezer_access_token": "",
         "lastfm_api_key": "",
         "lastfm_username": "",
-        "cache_dir": "cache"
+        "cache_dir": "cache",
+        "match_workers": 1,
+        "http_cache": True,
+        "window_days": 365,
+        "scrobble_retention_days": None
     }
 
     if os.path.exists(config_file):
@@ -480,6 +766,29 @@ def load_config():
 
 def main():
     """Main function to run the script."""
+    parser = argparse.ArgumentParser(description="Create a playlist of Deezer favorites you haven't played lately.")
+    parser.add_argument("--resume", action="store_true", help="finish writing the playlist of an interrupted run")
+    parser.add_argument("--metrics", metavar="PATH",
+                        help="write per-endpoint request metrics to PATH (Prometheus text for .prom, else JSON)")
+    parser.add_argument("--profile", action="store_true",
+                        help="print the time, CPU, item count and fuzzy comparisons of each pipeline stage")
+    parser.add_argument("--profile-stage", action="append", default=[], metavar="STAGE",
+                        help="also run STAGE under cProfile, e.g. match (implies --profile; repeatable)")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="also measure the peak memory of each stage (implies --profile; slower)")
+    parser.add_argument("--verbose", action="store_true", help="log how every played favorite was matched")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.verbose:
+        logger.setLevel(logging.DEBUG)
+    profile = args.profile or args.profile_stage or args.trace_memory
+
+    metrics = None
+    if args.metrics:
+        metrics = RequestMetrics()
+        shared_transport().use_metrics(metrics)
+
     try:
         # Load or create configuration
         config = load_config()
@@ -503,18 +812,35 @@ def main():
                 json.dump(config, f, indent=4)
             print("Saved credentials to config.json")
 
+        # Cache API responses on disk so repeated runs don't refetch the same pages
+        if config.get("http_cache", True):
+            shared_transport().use_cache(ResponseCache(os.path.join(cache_dir, "http_cache.sqlite")))
+
         # Create API clients
         from pydeez import PyDeez  # Import your existing Deezer client
         deezer_client = PyDeez(deezer_access_token)
-        lastfm_client = LastFmClient(lastfm_api_key, lastfm_username, cache_dir)
+        lastfm_client = LastFmClient(lastfm_api_key, lastfm_username, cache_dir,
+                                     retention_days=config.get("scrobble_retention_days"))
 
         # Create the analyzer and run
-        analyzer = DeezerFavoritesAnalyzer(deezer_client, lastfm_client, cache_dir)
-        playlist_name = input("Enter name for the new playlist (or press Enter for default): ")
-        if not playlist_name:
-            playlist_name = "Favorites Not Played in a Year"
+        profiler = StageProfiler(trace_memory=args.trace_memory, profile_stages=args.profile_stage,
+                                 profile_dir=os.path.join(cache_dir, "profiles"))
+        analyzer = DeezerFavoritesAnalyzer(deezer_client, lastfm_client, cache_dir,
+                                           match_workers=config.get("match_workers", 1), profiler=profiler)
+        if args.resume:
+            pending_job = analyzer.journal.pending()
+            if pending_job is None:
+                print("There is no interrupted run to resume.")
+                return
+            playlist_name = pending_job['job']
+            playlist_id = analyzer.resume_unheard_favorites_playlist()
+        else:
+            playlist_name = input("Enter name for the new playlist (or press Enter for default): ")
+            if not playlist_name:
+                playlist_name = "Favorites Not Played in a Year"
 
-        playlist_id = analyzer.create_unheard_favorites_playlist(playlist_name)
+            playlist_id = analyzer.create_unheard_favorites_playlist(playlist_name,
+                                                                    window_days=config.get("window_days", 365))
 
         if playlist_id:
             print(f"Playlist created! ID: {playlist_id}")
@@ -522,11 +848,24 @@ def main():
         else:
             print("No playlist was created.")
 
+        if profile:
+            profiler.print_report()
+
+        pool_stats = shared_transport().pool_stats()
+        print(f"HTTP requests: {pool_stats['requests']}, connections opened: {pool_stats['connections']}, "
+              f"reused: {pool_stats['reused']}")
+
     except Exception as e:
         print(f"An error occurred: {e}")
         import traceback
         traceback.print_exc()
 
+    finally:
+        if metrics is not None:
+            metrics.print_summary()
+            metrics.write(args.metrics)
+            print(f"Request metrics written to {args.metrics}")
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,578 @@
+import math
+from concurrent.futures import ProcessPoolExecutor
+from collections import defaultdict, namedtuple
+from typing import Iterable, List, Optional, Sequence
+import numpy as np
+from rapidfuzz.distance import Indel
+from rapidfuzz.process import cdist
+from normalize import canonical_identifier, canonical_key
+
+
+# Characters ordered from most to least common in artist/track names, used to
+# estimate token frequencies when an index is not given a corpus to count them
+# in.  Characters not listed count as rare.
+_COMMON_CHARS = " -etaoinsrhldcumfpgwybvkxjqz"
+_CHAR_COMMONNESS = {c: len(_COMMON_CHARS) - i for i, c in enumerate(_COMMON_CHARS)}
+
+# Length of the substrings (q-grams) FuzzyIndex indexes
+_GRAM_SIZE = 3
+
+# Characters are counted in this many buckets for FuzzyIndex's count filter;
+# characters sharing a bucket only make the filter less strict
+_CHAR_BUCKETS = 64
+
+_EPSILON = 1e-9
+
+# Per-process index built once by _init_match_worker
+_worker_index = None
+
+# Number of string pairs scored by ratio_matrix in this process; each one is
+# the equivalent of a fuzz.ratio call
+_scored_pairs = 0
+
+TrackMatch = namedtuple('TrackMatch', ['kind', 'listened', 'score'])
+
+
+def ratio_matrix(queries: Sequence[str], candidates: Sequence[str], workers: int = 1) -> np.ndarray:
+    """
+    Score every query against every candidate in bulk.
+
+    Scores are identical to fuzz.ratio: the indel distance of each pair is
+    computed by rapidfuzz's C++ cdist kernel and turned into a rounded 0-100
+    similarity the same way python-Levenshtein does.  Strings are compared
+    as-is, so normalize (e.g. lowercase) them once before calling.
+
+    Args:
+        queries: Pre-normalized query strings
+        candidates: Pre-normalized candidate strings
+        workers: Number of threads cdist may use (-1 for all cores)
+
+    Returns:
+        Integer array of shape (len(queries), len(candidates))
+    """
+    global _scored_pairs
+    if not len(queries) or not len(candidates):
+        return np.zeros((len(queries), len(candidates)), dtype=np.int32)
+
+    _scored_pairs += len(queries) * len(candidates)
+    distances = cdist(queries, candidates, scorer=Indel.distance, dtype=np.int64, workers=workers)
+    length_sums = np.add.outer(np.fromiter(map(len, queries), dtype=np.int64, count=len(queries)),
+                               np.fromiter(map(len, candidates), dtype=np.int64, count=len(candidates)))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = np.rint(100 * (1 - distances / length_sums))
+    # Two empty strings are equal, which fuzz.ratio scores as 100
+    scores[length_sums == 0] = 100
+    return scores.astype(np.int32)
+
+
+def scored_pair_count() -> int:
+    """
+    Get the number of string pairs scored so far, including those scored by match_tracks_parallel workers.
+
+    Returns:
+        Number of fuzz.ratio-equivalent comparisons made
+    """
+    return _scored_pairs
+
+
+def ratio_scores(query: str, candidates: Sequence[str]) -> np.ndarray:
+    """
+    Score one query against an array of candidates in bulk.
+
+    Args:
+        query: Pre-normalized query string
+        candidates: Pre-normalized candidate strings
+
+    Returns:
+        Integer array of fuzz.ratio scores, one per candidate
+    """
+    return ratio_matrix([query], candidates)[0]
+
+
+def _estimated_frequency(token):
+    # Later occurrences of a gram are rarer than its first: every string with
+    # three "the"s also has two
+    gram, occurrence = token
+    return sum(_CHAR_COMMONNESS.get(char, 0) for char in gram) / (occurrence + 1) ** 2
+
+
+def _tokenize(text: str) -> List[tuple]:
+    """
+    Split a string into (q-gram, occurrence) tokens.
+
+    Numbering repeated q-grams turns the q-gram multiset into a plain set, so
+    the size of the intersection of two token sets is the number of q-grams
+    the strings have in common.
+    """
+    seen = defaultdict(int)
+    tokens = []
+    for i in range(len(text) - _GRAM_SIZE + 1):
+        gram = text[i:i + _GRAM_SIZE]
+        tokens.append((gram, seen[gram]))
+        seen[gram] += 1
+    return tokens
+
+
+class FuzzyIndex:
+    """
+    Candidate index for fuzz.ratio lookups above a fixed score threshold.
+
+    fuzz.ratio is 2 * M / (len(a) + len(b)) where M is the length of the
+    longest common subsequence, so a pair reaching the threshold is at most a
+    few deletions and insertions apart.  A deletion destroys at most q of a
+    string's q-grams and an insertion at most q - 1, and every q-gram that
+    survives also occurs in the other string.  That gives a lower bound on the
+    q-grams any pair reaching the threshold shares, and with it a prefix of
+    each string's q-grams that must overlap (prefix filtering).  Only those
+    prefixes are indexed and probed, so a lookup scores a small shortlist
+    instead of every entry, without ever missing a match.
+
+    The prefixes are only selective if they consist of rare q-grams, so they
+    are sorted by how many strings of the corpus contain them, rarest first.
+    The order is fixed when the index is created; any fixed order keeps the
+    index exact.  Strings too short to be sure of sharing a q-gram with a
+    match are compared against every entry of a suitable length.
+
+    The shortlist is then narrowed by length and by character counts: M can't
+    exceed the number of characters two strings have in common, which is
+    checked for all candidates at once before any of them is scored.
+    """
+
+    def __init__(self, min_score: int, corpus: Optional[Iterable[str]] = None):
+        """
+        Args:
+            min_score: Minimum fuzz.ratio score (0-100) a lookup has to reach
+            corpus: Pre-normalized strings to count q-gram frequencies in, usually the strings
+                that will be added; without one, frequencies are estimated from character
+                commonness
+        """
+        self.min_score = min_score
+        # fuzz.ratio rounds, so anything at or above min_score - 0.5 may pass
+        self._min_ratio = (min_score - 0.5) / 100
+        self._frequencies = None
+        if corpus is not None:
+            self._frequencies = defaultdict(int)
+            for text in corpus:
+                for token in set(_tokenize(text)):
+                    self._frequencies[token] += 1
+        self._texts = []
+        self._ids_by_text = {}
+        self._lengths = np.zeros(0, dtype=np.int64)
+        self._char_counts = np.zeros((0, _CHAR_BUCKETS), dtype=np.uint8)
+        self._postings = defaultdict(list)
+        # Entries that may match a string without sharing a q-gram with it
+        self._unfiltered_ids = []
+        self._required_overlaps = {}
+
+    def __len__(self):
+        return len(self._texts)
+
+    def text(self, entry_id: int) -> str:
+        return self._texts[entry_id]
+
+    def add(self, text: str) -> int:
+        """
+        Add a (pre-normalized) string to the index.
+
+        Args:
+            text: String to index
+
+        Returns:
+            ID of the entry; adding the same string twice returns the same ID
+        """
+        if text in self._ids_by_text:
+            return self._ids_by_text[text]
+
+        entry_id = len(self._texts)
+        self._texts.append(text)
+        self._ids_by_text[text] = entry_id
+        if entry_id == len(self._lengths):
+            # Grown geometrically so adding one string at a time stays cheap
+            capacity = max(16, 2 * len(self._lengths))
+            self._lengths = np.resize(self._lengths, capacity)
+            self._char_counts = np.resize(self._char_counts, (capacity, _CHAR_BUCKETS))
+        self._lengths[entry_id] = len(text)
+        # Saturating at 255 is safe: queries are only count-filtered up to that length
+        self._char_counts[entry_id] = np.minimum(self._count_chars(text), 255)
+        if text:
+            prefix = self._prefix(text)
+            if prefix is None:
+                self._unfiltered_ids.append(entry_id)
+            else:
+                for token in prefix:
+                    self._postings[token].append(entry_id)
+        return entry_id
+
+    def candidates(self, query: str) -> List[int]:
+        """
+        Get the IDs of every entry that could score at least min_score against the query.
+
+        Args:
+            query: Pre-normalized query string
+
+        Returns:
+            List of entry IDs, a superset of the actual matches
+        """
+        if not query:
+            # fuzz.ratio only scores an empty string against itself
+            return [self._ids_by_text['']] if '' in self._ids_by_text else []
+
+        shortest, longest = self._length_window(len(query))
+        lengths = self._lengths[:len(self._texts)]
+        candidate_ids = np.flatnonzero((lengths >= shortest) & (lengths <= longest))
+        prefix = self._prefix(query)
+        # The posting lists only narrow the search down when they are shorter than
+        # the length window; on a corpus of few distinct q-grams they cover it
+        if prefix is not None:
+            postings = [self._postings.get(token, ()) for token in prefix]
+            if len(self._unfiltered_ids) + sum(map(len, postings)) < len(candidate_ids):
+                shortlist = set(self._unfiltered_ids).union(*postings)
+                shortlist = np.fromiter(shortlist, dtype=np.int64, count=len(shortlist))
+                candidate_ids = candidate_ids[np.isin(candidate_ids, shortlist, assume_unique=True)]
+
+        if len(query) <= 255:
+            query_counts = self._count_chars(query).astype(np.uint8)
+            common_chars = np.minimum(self._char_counts[candidate_ids], query_counts).sum(axis=1, dtype=np.int32)
+            required_chars = np.ceil(self._min_ratio * (len(query) + self._lengths[candidate_ids]) / 2 - _EPSILON)
+            candidate_ids = candidate_ids[common_chars >= required_chars]
+        return candidate_ids.tolist()
+
+    def search(self, query: str):
+        """
+        Score the query against its candidates.
+
+        Args:
+            query: Pre-normalized query string
+
+        Returns:
+            Iterator of (entry_id, score) for every entry scoring at least min_score
+        """
+        candidate_ids = self.candidates(query)
+        scores = ratio_scores(query, [self._texts[entry_id] for entry_id in candidate_ids])
+        for entry_id, score in zip(candidate_ids, scores.tolist()):
+            if score >= self.min_score:
+                yield entry_id, score
+
+    @staticmethod
+    def _count_chars(text):
+        code_points = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+        return np.bincount(code_points % _CHAR_BUCKETS, minlength=_CHAR_BUCKETS)
+
+    def _length_window(self, length):
+        ratio = self._min_ratio
+        shortest = math.ceil(length * ratio / (2 - ratio) - _EPSILON)
+        longest = math.floor(length * (2 - ratio) / ratio + _EPSILON)
+        return shortest, longest
+
+    def _required_overlap(self, length):
+        # The fewest q-grams a string of this length shares with any string
+        # it can reach the threshold with
+        if length not in self._required_overlaps:
+            grams = length - _GRAM_SIZE + 1
+            required = grams
+            shortest, longest = self._length_window(length)
+            for partner_length in range(shortest, longest + 1):
+                common = math.ceil(self._min_ratio * (length + partner_length) / 2 - _EPSILON)
+                if common > min(length, partner_length):
+                    continue
+                deletions, insertions = length - common, partner_length - common
+                required = min(required, grams - _GRAM_SIZE * deletions - (_GRAM_SIZE - 1) * insertions)
+            self._required_overlaps[length] = required
+        return self._required_overlaps[length]
+
+    def _prefix(self, text):
+        # None if a match might share no q-gram with the text at all
+        required_overlap = self._required_overlap(len(text))
+        if required_overlap < 1:
+            return None
+        tokens = sorted(_tokenize(text), key=self._token_order)
+        return tokens[:len(tokens) - required_overlap + 1]
+
+    def _token_order(self, token):
+        # Tokens the corpus doesn't contain come first, as the rarest of all
+        if self._frequencies is None:
+            return _estimated_frequency(token), token
+        return self._frequencies.get(token, 0), token
+
+
+class CanonicalIndex:
+    """
+    Hash index of listened tracks by canonical key.
+
+    Spellings that only differ in case, diacritics, punctuation, featured
+    artists or release variant tags share a canonical key, so most played
+    favorites are found with one dictionary lookup and never need fuzzy
+    scoring.
+    """
+
+    def __init__(self, listened_tracks: Iterable[str], normalized: bool = False):
+        """
+        Args:
+            listened_tracks: Listened tracks in "artist - track" format
+            normalized: The listened tracks are already lowercased keys, so exact lookups ignore case
+        """
+        self.normalized = normalized
+        self._listened = set(listened_tracks)
+        self._listened_by_key = {}
+        # Sorted so the reported match doesn't depend on set order
+        for listened in sorted(self._listened):
+            key = canonical_identifier(listened)
+            if key is not None:
+                self._listened_by_key.setdefault(key, listened)
+
+    def __len__(self):
+        return len(self._listened)
+
+    def __iter__(self):
+        return iter(self._listened)
+
+    def __contains__(self, track_identifier):
+        return track_identifier in self._listened
+
+    def find_match(self, artist_name: str, track_name: str) -> Optional[TrackMatch]:
+        """
+        Find a listened track spelled the same, or with the same canonical key.
+
+        Args:
+            artist_name: Name of the artist
+            track_name: Name of the track
+
+        Returns:
+            A TrackMatch of kind 'exact' or 'canonical', or None
+        """
+        track_identifier = f"{artist_name} - {track_name}"
+        if self.normalized:
+            track_identifier = track_identifier.lower()
+        if track_identifier in self._listened:
+            return TrackMatch('exact', track_identifier, 100)
+
+        listened = self._listened_by_key.get(canonical_key(artist_name, track_name))
+        return TrackMatch('canonical', listened, 100) if listened is not None else None
+
+
+class ListenedTrackIndex:
+    """Prebuilt, reusable lookup over a set of listened "artist - track" strings."""
+
+    def __init__(self, listened_tracks: Iterable[str], similarity_threshold: int = 85,
+                 title_threshold: int = 90, artist_threshold: int = 70, normalized: bool = False):
+        """
+        Build the index.
+
+        Args:
+            listened_tracks: Listened tracks in "artist - track" format
+            similarity_threshold: Minimum score for the whole "artist - track" string
+            title_threshold: Minimum score for the track title alone
+            artist_threshold: Minimum artist score accompanying a title match
+            normalized: The listened tracks are already lowercased keys, so they are indexed
+                as-is and exact lookups ignore case
+        """
+        self.artist_threshold = artist_threshold
+        self.normalized = normalized
+        self._canonical = CanonicalIndex(listened_tracks, normalized)
+        self._listened_by_identifier = {}
+        self._entries_by_title = defaultdict(list)
+
+        # Sorted so entry IDs, and with them the reported matches, don't depend on set order
+        listened_tracks = sorted(self._canonical)
+        identifiers = [listened if normalized else listened.lower() for listened in listened_tracks]
+        titled = [(listened, listened.split(" - ", 1)) for listened in listened_tracks]
+        titled = [(listened, parts) for listened, parts in titled if len(parts) > 1]
+        titles = [listened_title if normalized else listened_title.lower() for _, (_, listened_title) in titled]
+
+        # Both indexes count token frequencies in what they will hold
+        self._identifiers = FuzzyIndex(similarity_threshold, corpus=identifiers)
+        self._titles = FuzzyIndex(title_threshold, corpus=titles)
+
+        for listened, identifier in zip(listened_tracks, identifiers):
+            identifier_id = self._identifiers.add(identifier)
+            self._listened_by_identifier.setdefault(identifier_id, listened)
+
+        for (listened, (listened_artist, listened_title)), title in zip(titled, titles):
+            if not normalized:
+                listened_artist = listened_artist.lower()
+            title_id = self._titles.add(title)
+            self._entries_by_title[title_id].append((listened_artist, listened_title))
+
+    def __len__(self):
+        return len(self._canonical)
+
+    def __contains__(self, track_identifier):
+        return track_identifier in self._canonical
+
+    def find_match(self, artist_name: str, track_name: str) -> Optional[TrackMatch]:
+        """
+        Find a listened track matching the given artist and title.
+
+        Args:
+            artist_name: Name of the artist
+            track_name: Name of the track
+
+        Returns:
+            A TrackMatch of kind 'exact', 'canonical', 'fuzzy' or 'title', or None if nothing matches
+        """
+        # Fuzzy scoring is only needed for the residue the hash join can't match
+        match = self._canonical.find_match(artist_name, track_name)
+        if match is not None:
+            return match
+
+        for identifier_id, score in self._identifiers.search(f"{artist_name} - {track_name}".lower()):
+            return TrackMatch('fuzzy', self._listened_by_identifier[identifier_id], score)
+
+        artist_name = artist_name.lower()
+        for title_id, score in self._titles.search(track_name.lower()):
+            entries = self._entries_by_title[title_id]
+            artist_scores = ratio_scores(artist_name, [listened_artist for listened_artist, _ in entries])
+            for (_, listened_title), artist_score in zip(entries, artist_scores.tolist()):
+                if artist_score >= self.artist_threshold:
+                    return TrackMatch('title', listened_title, score)
+
+        return None
+
+
+class NearDuplicateClusterer:
+    """
+    Incremental near-duplicate clustering of (artist, track) pairs.
+
+    The first pair of each cluster is its representative; a new pair joins the
+    first cluster whose representative is similar in both artist and track,
+    otherwise it starts a new cluster.  Representatives are blocked on their
+    track title, so adding a pair only scores it against plausible neighbours.
+    """
+
+    def __init__(self, artist_threshold: int = 90, track_threshold: int = 90,
+                 track_names: Optional[Iterable[str]] = None):
+        """
+        Args:
+            artist_threshold: Minimum artist similarity (0-100) for a duplicate
+            track_threshold: Minimum track similarity (0-100) for a duplicate
+            track_names: Track names that will be added, if known up front; the
+                title index then blocks on the q-grams that are rare among them
+        """
+        self.artist_threshold = artist_threshold
+        corpus = [track_name.lower() for track_name in track_names] if track_names is not None else None
+        self._titles = FuzzyIndex(track_threshold, corpus=corpus)
+        self._representatives_by_title = defaultdict(list)
+        self.clusters = []
+
+    def __len__(self):
+        return len(self.clusters)
+
+    def find_cluster(self, artist_name: str, track_name: str) -> Optional[int]:
+        """
+        Find the cluster an (artist, track) pair is a near-duplicate of.
+
+        Args:
+            artist_name: Name of the artist
+            track_name: Name of the track
+
+        Returns:
+            Index of the matching cluster, or None if the pair is new
+        """
+        representatives = [
+            representative
+            for title_id, _ in self._titles.search(track_name.lower())
+            for representative in self._representatives_by_title[title_id]
+        ]
+        artist_scores = ratio_scores(artist_name.lower(), [artist for _, artist in representatives])
+        matching_clusters = [cluster_id
+                             for (cluster_id, _), artist_score in zip(representatives, artist_scores.tolist())
+                             if artist_score >= self.artist_threshold]
+        return min(matching_clusters) if matching_clusters else None
+
+    def add(self, artist_name: str, track_name: str) -> bool:
+        """
+        Add an (artist, track) pair, clustering it with any near-duplicate seen before.
+
+        Args:
+            artist_name: Name of the artist
+            track_name: Name of the track
+
+        Returns:
+            True if the pair started a new cluster, False if it was a near-duplicate
+        """
+        cluster_id = self.find_cluster(artist_name, track_name)
+        if cluster_id is not None:
+            self.clusters[cluster_id].append((artist_name, track_name))
+            return False
+
+        cluster_id = len(self.clusters)
+        self.clusters.append([(artist_name, track_name)])
+        title_id = self._titles.add(track_name.lower())
+        self._representatives_by_title[title_id].append((cluster_id, artist_name.lower()))
+        return True
+
+
+def _init_match_worker(listened_tracks, similarity_threshold, normalized):
+    global _worker_index
+    _worker_index = ListenedTrackIndex(listened_tracks, similarity_threshold, normalized=normalized)
+
+
+def find_match_safely(listened_index: ListenedTrackIndex, artist_name: str, track_name: str) -> Optional[TrackMatch]:
+    """
+    Look up a track, treating any error in matching as "not played".
+
+    Args:
+        listened_index: Index over the listened tracks
+        artist_name: Name of the artist
+        track_name: Name of the track
+
+    Returns:
+        The TrackMatch, or None if nothing matches or matching failed
+    """
+    try:
+        return listened_index.find_match(artist_name, track_name)
+    except Exception:
+        return None
+
+
+def _match_shard(shard):
+    scored_before = _scored_pairs
+    matches = [find_match_safely(_worker_index, artist_name, track_name) for artist_name, track_name in shard]
+    return matches, _scored_pairs - scored_before
+
+
+def match_tracks_parallel(tracks: Sequence[tuple], listened_tracks: Iterable[str], workers: int,
+                          similarity_threshold: int = 85, shard_size: int = 500,
+                          normalized: bool = False) -> List[Optional[TrackMatch]]:
+    """
+    Match (artist, track) pairs against the listened tracks on a process pool.
+
+    Pairs are first joined against the listened tracks by canonical key in
+    this process; only the residue is sent to the workers. The listened tracks
+    are sent to each worker once, which builds its own ListenedTrackIndex;
+    shards of pairs are then matched in parallel and the results are returned
+    in input order, exactly as a serial run would.
+
+    Args:
+        tracks: (artist_name, track_name) pairs to look up
+        listened_tracks: Listened tracks in "artist - track" format
+        workers: Number of worker processes
+        similarity_threshold: Minimum score for the whole "artist - track" string
+        shard_size: Number of pairs per task
+        normalized: The listened tracks are already lowercased keys
+
+    Returns:
+        One TrackMatch or None per input pair
+    """
+    global _scored_pairs
+    listened_tracks = list(listened_tracks)
+    canonical_index = CanonicalIndex(listened_tracks, normalized)
+    matches = [canonical_index.find_match(artist_name, track_name) for artist_name, track_name in tracks]
+
+    residue = [i for i, match in enumerate(matches) if match is None]
+    if not residue:
+        return matches
+
+    shards = [[tracks[i] for i in residue[start:start + shard_size]] for start in range(0, len(residue), shard_size)]
+    residue_matches = []
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=_init_match_worker,
+                             initargs=(listened_tracks, similarity_threshold, normalized)) as executor:
+        for shard_matches, shard_scored_pairs in executor.map(_match_shard, shards):
+            residue_matches.extend(shard_matches)
+            # Counted in the workers; added here so callers see the total
+            _scored_pairs += shard_scored_pairs
+
+    for i, match in zip(residue, residue_matches):
+        matches[i] = match
+    return matches
@@ -0,0 +1,125 @@
+import re
+import unicodedata
+from functools import lru_cache
+from typing import Optional
+
+
+# Words that mark a bracketed or dash-separated suffix as a release variant of
+# the same recording rather than part of the title, e.g. "(2011 Remaster)",
+# "[Radio Edit]" or " - Single Version".
+_VERSION_WORDS = frozenset({
+    'remaster', 'remastered', 'version', 'edit', 'mono', 'stereo', 'deluxe', 'bonus', 'anniversary',
+    'explicit', 'clean', 'single', 'album', 'original'
+})
+# Words naming a different recording. A suffix containing one is kept even if it
+# also has a version word, so "(Live Version)", "- Demo Version", "(Original Mix)"
+# and "(Extended Edit)" don't match the studio track.
+_RECORDING_WORDS = frozenset({
+    'live', 'acoustic', 'instrumental', 'demo', 'remix', 'mix', 'extended', 'piano', 'unplugged',
+    'orchestral', 'acapella', 'cappella', 'karaoke', 'reprise', 'rehearsal', 'session', 'sessions',
+    'dub', 'cover', 'rework', 'vip', 'take', 'alternate', 'alternative'
+})
+_FEATURE_WORD = r'(?:feat|ft|featuring)\b\.?'
+
+_BRACKETED = re.compile(r'\s*[(\[{]([^)\]}]*)[)\]}]')
+_TITLE_FEATURE = re.compile(r'\s+(?:feat|ft|featuring)\b\.?\s.*$', re.IGNORECASE)
+_ARTIST_FEATURE = re.compile(r'\s+(?:feat|ft|featuring|vs)\b\.?\s.*$', re.IGNORECASE)
+_FEATURE_GROUP = re.compile(r'^\s*' + _FEATURE_WORD, re.IGNORECASE)
+_WORD = re.compile(r'\w+')
+_JOINING = re.compile(r"['.\u2019]")
+_NON_WORD = re.compile(r'[\W_]+')
+
+# Large enough to hold every favorite and every listened track of a big library
+_CACHE_SIZE = 2 ** 18
+
+
+def _fold(text: str) -> str:
+    """Casefold and strip diacritics: "Beyoncé" becomes "beyonce"."""
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def _is_variant(text: str) -> bool:
+    """Whether a bracketed or dash-separated suffix names a feature or a release variant."""
+    if _FEATURE_GROUP.match(text):
+        return True
+    words = _WORD.findall(text)
+    return any(word in _VERSION_WORDS for word in words) and not any(word in _RECORDING_WORDS for word in words)
+
+
+def _collapse(text: str) -> str:
+    """Turn "&" into "and", drop punctuation and squeeze whitespace: "T.N.T." and "TNT" are both "tnt"."""
+    return ' '.join(_NON_WORD.sub(' ', _JOINING.sub('', text.replace('&', ' and '))).split())
+
+
+@lru_cache(maxsize=_CACHE_SIZE)
+def canonical_artist(artist_name: str) -> str:
+    """
+    Get the canonical form of an artist name.
+
+    Featured artists are dropped, so "Calvin Harris feat. Rihanna" becomes "calvin harris".
+
+    Args:
+        artist_name: Name of the artist
+
+    Returns:
+        The casefolded name without diacritics, features or punctuation
+    """
+    folded = _fold(artist_name)
+    return _collapse(_ARTIST_FEATURE.sub('', folded)) or _collapse(folded)
+
+
+@lru_cache(maxsize=_CACHE_SIZE)
+def canonical_title(track_name: str) -> str:
+    """
+    Get the canonical form of a track title.
+
+    Featured artists and release variant tags are dropped, so "Under Pressure (feat. Bowie)
+    - 2011 Remaster" becomes "under pressure". Brackets that are part of the title, like
+    "(Don't Fear) The Reaper", and tags of a different recording, like "(Live Version)",
+    "(Original Mix)" or "(With Strings)", are kept.
+
+    Args:
+        track_name: Title of the track
+
+    Returns:
+        The casefolded title without diacritics, features, variant tags or punctuation
+    """
+    folded = _fold(track_name)
+    title = _BRACKETED.sub(lambda group: '' if _is_variant(group.group(1)) else group.group(0), folded)
+    segments = title.split(' - ')
+    while len(segments) > 1 and _is_variant(segments[-1]):
+        segments.pop()
+    title = _TITLE_FEATURE.sub('', ' - '.join(segments))
+    # A title that is nothing but a tag, like "(Intro)", keeps its words
+    return _collapse(title) or _collapse(folded)
+
+
+def canonical_key(artist_name: str, track_name: str) -> str:
+    """
+    Get the key two spellings of the same track share.
+
+    Args:
+        artist_name: Name of the artist
+        track_name: Title of the track
+
+    Returns:
+        The canonical "artist - title" key
+    """
+    return f"{canonical_artist(artist_name)} - {canonical_title(track_name)}"
+
+
+def canonical_identifier(track_identifier: str) -> Optional[str]:
+    """
+    Get the canonical key of a track in "artist - track" format.
+
+    Args:
+        track_identifier: Track as "artist - track", e.g. a Last.fm scrobble key
+
+    Returns:
+        The canonical key, or None if the identifier has no " - " separator
+    """
+    parts = track_identifier.split(" - ", 1)
+    if len(parts) < 2:
+        return None
+    return canonical_key(*parts)
@@ -0,0 +1,112 @@
+import cProfile
+import json
+import os
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Iterable, List, Optional
+
+from matching import scored_pair_count
+
+
+class StageProfiler:
+    """Wall time, CPU time, item counts, fuzzy comparisons and peak memory per pipeline stage."""
+
+    def __init__(self, trace_memory: bool = False, profile_stages: Iterable[str] = (),
+                 profile_dir: Optional[str] = None):
+        """
+        Set up the profiler.
+
+        Args:
+            trace_memory: Measure the peak memory allocated during each stage with tracemalloc,
+                which slows allocation-heavy stages down noticeably
+            profile_stages: Names of the stages to run under cProfile
+            profile_dir: Directory the .prof files of profiled stages are written to
+        """
+        self.trace_memory = trace_memory
+        self.profile_stages = set(profile_stages)
+        self.profile_dir = profile_dir or "."
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Measure a stage of the pipeline.
+
+        Args:
+            name: Name of the stage
+
+        Yields:
+            The stage's record; set its 'items' to the number of items the stage processed
+        """
+        record = {"stage": name, "items": None}
+        profiler = cProfile.Profile() if name in self.profile_stages else None
+        started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            memory_before = tracemalloc.get_traced_memory()[0]
+
+        scored_pairs_before = scored_pair_count()
+        cpu_started = time.process_time()
+        started = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            record["wall_time"] = time.perf_counter() - started
+            record["cpu_time"] = time.process_time() - cpu_started
+            record["fuzzy_comparisons"] = scored_pair_count() - scored_pairs_before
+            if self.trace_memory:
+                record["peak_memory"] = tracemalloc.get_traced_memory()[1] - memory_before
+                if started_tracing:
+                    tracemalloc.stop()
+            if profiler is not None:
+                record["profile"] = self._dump_profile(name, profiler)
+            self.stages.append(record)
+
+    def _dump_profile(self, name: str, profiler: cProfile.Profile) -> str:
+        if not os.path.exists(self.profile_dir):
+            os.makedirs(self.profile_dir)
+        path = os.path.join(self.profile_dir, f"{name}.prof")
+        profiler.dump_stats(path)
+        return path
+
+    def report(self) -> List[dict]:
+        """
+        Get the records of every stage measured so far, in the order they ran.
+
+        Returns:
+            List of dictionaries with 'stage', 'items', 'wall_time', 'cpu_time' and
+            'fuzzy_comparisons', plus 'peak_memory' (bytes) and 'profile' (path) when enabled
+        """
+        return list(self.stages)
+
+    def print_report(self):
+        """Print a table of the measured stages, with the hottest functions of profiled stages."""
+        print(f"{'stage':<18} {'wall':>8} {'cpu':>8} {'items':>8} {'fuzzy':>10} {'peak mem':>10}")
+        for record in self.stages:
+            items = record["items"] if record["items"] is not None else "-"
+            peak_memory = f"{record['peak_memory'] / 2 ** 20:.1f}MB" if "peak_memory" in record else "-"
+            print(f"{record['stage']:<18} {record['wall_time']:>7.2f}s {record['cpu_time']:>7.2f}s "
+                  f"{items:>8} {record['fuzzy_comparisons']:>10} {peak_memory:>10}")
+
+        for record in self.stages:
+            if "profile" in record:
+                print(f"\nHottest functions in {record['stage']} ({record['profile']}):")
+                pstats.Stats(record["profile"]).sort_stats("cumulative").print_stats(15)
+
+    def write(self, path: str):
+        """
+        Write the stage records to a JSON file.
+
+        Args:
+            path: Path of the file
+        """
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=4)
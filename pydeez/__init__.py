@@ -1 +1,11 @@
 from .pydeez import PyDeez
+from .async_pydeez import AsyncPyDeez
+from .job_journal import JobJournal
+from .playlist_index import PlaylistIndex
+from .playlist_writer import PlaylistWriter
+from .track_table import TrackTable
+from .transport import HttpTransport, shared_transport
+from .rate_limit import RateLimiter, TokenBucket
+from .response_cache import ResponseCache
+from .metrics import RequestMetrics
+from .errors import DeezerApiError
@@ -1,7 +1,14 @@
+import sys
+
+
 class Album:
+    __slots__ = ('_id', '_title')
+    # Immutable, so tracks on the same album can share one instance
+    _instances = {}
+
     def __init__(self, the_id, title):
-        self._id = the_id
-        self._title = title
+        object.__setattr__(self, '_id', the_id)
+        object.__setattr__(self, '_title', sys.intern(title))
 
     @property
     def id(self):
@@ -13,10 +20,20 @@ class Album:
 
     @staticmethod
     def from_dict(the_dict):
-        return Album(
-            the_id=the_dict['id'],
-            title=the_dict['title']
-        )
+        key = (the_dict['id'], the_dict['title'])
+        album = Album._instances.get(key)
+        if album is None:
+            album = Album._instances[key] = Album(the_id=the_dict['id'], title=the_dict['title'])
+        return album
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Album is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('Album is immutable')
+
+    def __reduce__(self):
+        return Album, (self._id, self._title)
 
     def __repr__(self):
         return self.__str__()
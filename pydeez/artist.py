@@ -1,7 +1,14 @@
+import sys
+
+
 class Artist:
+    __slots__ = ('_id', '_name')
+    # Immutable, so tracks by the same artist can share one instance
+    _instances = {}
+
     def __init__(self, the_id, name):
-        self._id = the_id
-        self._name = name
+        object.__setattr__(self, '_id', the_id)
+        object.__setattr__(self, '_name', sys.intern(name))
 
     @property
     def id(self):
@@ -13,10 +20,21 @@ class Artist:
 
     @staticmethod
     def from_dict(the_dict):
-        return Artist(
-            the_id=the_dict['id'] if 'id' in the_dict else 0,
-            name=the_dict['name']
-        )
+        the_id = the_dict['id'] if 'id' in the_dict else 0
+        key = (the_id, the_dict['name'])
+        artist = Artist._instances.get(key)
+        if artist is None:
+            artist = Artist._instances[key] = Artist(the_id=the_id, name=the_dict['name'])
+        return artist
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Artist is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('Artist is immutable')
+
+    def __reduce__(self):
+        return Artist, (self._id, self._name)
 
     def __repr__(self):
         return self.__str__()
@@ -24,5 +42,5 @@ class Artist:
     def __str__(self):
         return str({
             'id': self._id,
-            'title': self.names
+            'name': self._name
         })
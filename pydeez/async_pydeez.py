@@ -0,0 +1,91 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from .playlist_index import PlaylistIndex
+from .pydeez import PyDeez
+from .track import Track
+from tqdm import tqdm as statusify
+
+
+class AsyncPyDeez:
+    _DEFAULT_MAX_IN_FLIGHT = 8
+
+    def __init__(self, access_token, max_in_flight=_DEFAULT_MAX_IN_FLIGHT, transport=None,
+                 base_url=PyDeez._BASE_URL):
+        # Requests go through the blocking client on a bounded pool of threads,
+        # so at most max_in_flight of them are outstanding at any time.  Give
+        # the transport at least that many pooled connections.
+        self._pydeez = PyDeez(access_token, transport, base_url)
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='pydeez')
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    async def _call(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def _api_get(self, url):
+        return await self._call(self._pydeez._api_get, url)
+
+    async def get_playlists(self, prefixes=None):
+        all_playlists = await self._get_all_pages(self._pydeez._my_playlists_url, lambda raw_playlist: raw_playlist)
+        return PyDeez._filter_playlists(all_playlists, prefixes)
+
+    async def get_playlist_index(self):
+        return PlaylistIndex.from_dicts(await self.get_playlists())
+
+    async def get_favourite_tracks(self):
+        return await self._get_all_pages(self._pydeez._my_favourites_url, Track.from_dict)
+
+    async def get_tracks_for_playlists(self, playlists):
+        status = statusify(total=len(playlists), desc='Retrieving Playlist Tracks')
+
+        async def get_tracks_with_status(playlist):
+            tracks = await self.get_tracks_for_playlist(playlist)
+            status.update()
+            return tracks
+
+        try:
+            track_lists = await asyncio.gather(*[get_tracks_with_status(playlist) for playlist in playlists])
+        finally:
+            status.close()
+        return PyDeez._flatten(track_lists)
+
+    async def get_tracks_for_playlist(self, playlist):
+        return await self._get_all_pages(self._pydeez._playlist_tracks_url.format(playlist.id), Track.from_dict)
+
+    async def _get_all_pages(self, url, from_dict):
+        items = []
+        while url is not None:
+            page = await self._api_get(url)
+            items.extend(from_dict(item) for item in page['data'])
+            url = page.get('next')
+        return items
+
+    async def create_playlist(self, playlist_title):
+        return await self._call(self._pydeez.create_playlist, playlist_title)
+
+    async def add_tracks_to_playlist_by_track_ids(self, playlist_id, track_ids):
+        return await self._call(self._pydeez.add_tracks_to_playlist_by_track_ids, playlist_id, track_ids)
+
+    async def delete_playlists(self, prefixes):
+        playlists = await self.get_playlists(prefixes=prefixes)
+        return await self.delete_playlists_by_ids([playlist.id for playlist in playlists])
+
+    async def delete_playlists_by_ids(self, playlist_ids):
+        # At most max_in_flight deletes run at once, paced by the transport's
+        # rate limiter. Returns {playlist_id: deleted} in input order.
+        results = await asyncio.gather(*[self.delete_playlist_by_id(playlist_id) for playlist_id in playlist_ids],
+                                       return_exceptions=True)
+        for playlist_id, result in zip(playlist_ids, results):
+            if isinstance(result, Exception):
+                print('Could not delete playlist {}: {}'.format(playlist_id, result))
+        return {playlist_id: result is True for playlist_id, result in zip(playlist_ids, results)}
+
+    async def delete_playlist_by_id(self, playlist_id):
+        return await self._call(self._pydeez.delete_playlist_by_id, playlist_id)
@@ -0,0 +1,23 @@
+import json
+
+
+class DeezerApiError(Exception):
+    # An error body Deezer answered a write with, e.g.
+    # {"error": {"type": "OAuthException", "message": "...", "code": 300}}
+    def __init__(self, error):
+        self.type = error.get('type')
+        self.code = error.get('code')
+        self.message = error.get('message')
+        super().__init__('{} ({}): {}'.format(self.type, self.code, self.message))
+
+    @staticmethod
+    def from_response(response):
+        # The error of a response, or None if it isn't an error body
+        try:
+            body = json.loads(response.text)
+        except ValueError:
+            return None
+        if not isinstance(body, dict) or 'error' not in body:
+            return None
+        error = body['error']
+        return DeezerApiError(error if isinstance(error, dict) else {'message': error})
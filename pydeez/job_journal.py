@@ -0,0 +1,92 @@
+import json
+import os
+import threading
+
+
+class JobJournal:
+    # Append-only JSON-lines log of a playlist writing job. Every record is
+    # flushed and fsynced before the operation it confirms is considered
+    # done, so after a crash the journal never claims more than happened.
+    #
+    #   {"op": "begin", "job": ..., "meta": {...}}
+    #   {"op": "plan", "index": 0, "title": ..., "track_ids": [...]}
+    #   {"op": "created", "index": 0, "playlist_id": ...}
+    #   {"op": "filled", "index": 0, "missing": [...]}
+    #   {"op": "done"}
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._path = path
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return self._path
+
+    def begin(self, job, meta=None):
+        # Starts a new job, discarding the previous one's records
+        with self._lock, open(self._path, 'w', encoding='utf-8') as f:
+            self._write(f, {'op': 'begin', 'job': job, 'meta': meta or {}})
+
+    def record_planned(self, index, title, track_ids):
+        self._append({'op': 'plan', 'index': index, 'title': title, 'track_ids': list(track_ids)})
+
+    def record_created(self, index, playlist_id):
+        self._append({'op': 'created', 'index': index, 'playlist_id': playlist_id})
+
+    def record_filled(self, index, missing_ids):
+        self._append({'op': 'filled', 'index': index, 'missing': list(missing_ids)})
+
+    def record_done(self):
+        self._append({'op': 'done'})
+
+    def pending(self):
+        # The unfinished job as {'job', 'meta', 'playlists'}, where each
+        # playlist has 'index', 'title', 'track_ids', 'playlist_id' (None
+        # until created) and 'filled'; None if there is nothing to resume
+        if not os.path.exists(self._path):
+            return None
+
+        job = None
+        playlists = {}
+        for record in self._records():
+            op = record['op']
+            if op == 'begin':
+                job = {'job': record['job'], 'meta': record['meta']}
+                playlists = {}
+            elif op == 'plan':
+                playlists[record['index']] = {'index': record['index'], 'title': record['title'],
+                                              'track_ids': record['track_ids'], 'playlist_id': None,
+                                              'filled': False}
+            elif op == 'created':
+                playlists[record['index']]['playlist_id'] = record['playlist_id']
+            elif op == 'filled':
+                playlists[record['index']]['filled'] = True
+            elif op == 'done':
+                job = None
+
+        if job is None:
+            return None
+        job['playlists'] = [playlists[index] for index in sorted(playlists)]
+        return job
+
+    def _records(self):
+        with open(self._path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # A record cut short by the crash; nothing after it was confirmed
+                    return
+
+    def _append(self, record):
+        with self._lock, open(self._path, 'a', encoding='utf-8') as f:
+            self._write(f, record)
+
+    @staticmethod
+    def _write(f, record):
+        f.write(json.dumps(record) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
@@ -0,0 +1,176 @@
+import json
+import re
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+
+class RequestMetrics:
+    # Collects per-endpoint request statistics from an HttpTransport. Any
+    # object with the same record_* methods can be plugged in instead.
+    #
+    # Latencies are in seconds, measured from sending the request to having
+    # the whole response; time waiting for the rate limiter is counted
+    # separately as throttle time.
+    _LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    _ID_SEGMENT = re.compile(r'^\d+$')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = defaultdict(self._new_endpoint)
+            self._started = time.perf_counter()
+            self._cpu_started = time.process_time()
+
+    def _new_endpoint(self):
+        return {
+            'requests': 0,
+            'errors': 0,
+            'cache_hits': 0,
+            'retries': 0,
+            'quota_retries': 0,
+            'bytes_out': 0,
+            'bytes_in': 0,
+            'latency_sum': 0.0,
+            'latency_buckets': [0] * (len(self._LATENCY_BUCKETS) + 1),
+            'throttle_sleep': 0.0
+        }
+
+    @classmethod
+    def endpoint(cls, method, url, params=None):
+        # Ids are collapsed so every playlist counts as the same endpoint;
+        # Last.fm puts the endpoint in the method parameter
+        _, host, path, _, _ = urlsplit(url)
+        path = '/'.join('{id}' if cls._ID_SEGMENT.match(segment) else segment for segment in path.split('/'))
+        name = '{} {}{}'.format(method, host, path)
+        if params and 'method' in params:
+            name += '?method={}'.format(params['method'])
+        return name
+
+    def record_request(self, method, url, params, response, latency, throttle_sleep):
+        request = response.request
+        bytes_out = len(request.url) + len(request.body or b'') if request is not None else 0
+        # Connection errors and 5xx answers that urllib3 retried before this response
+        retries = response.raw.retries if response.raw is not None else None
+        retry_count = len(retries.history) if retries is not None and hasattr(retries, 'history') else 0
+
+        with self._lock:
+            stats = self._endpoints[self.endpoint(method, url, params)]
+            stats['requests'] += 1
+            stats['errors'] += response.status_code >= 400
+            stats['retries'] += retry_count
+            stats['bytes_out'] += bytes_out
+            stats['bytes_in'] += len(response.content)
+            stats['latency_sum'] += latency
+            stats['latency_buckets'][self._bucket(latency)] += 1
+            stats['throttle_sleep'] += throttle_sleep
+
+    def record_cache_hit(self, method, url, params):
+        with self._lock:
+            self._endpoints[self.endpoint(method, url, params)]['cache_hits'] += 1
+
+    def record_quota_retry(self, method, url, params):
+        with self._lock:
+            self._endpoints[self.endpoint(method, url, params)]['quota_retries'] += 1
+
+    def _bucket(self, latency):
+        for i, upper_bound in enumerate(self._LATENCY_BUCKETS):
+            if latency <= upper_bound:
+                return i
+        return len(self._LATENCY_BUCKETS)
+
+    def snapshot(self):
+        # Per-endpoint statistics plus a run summary. Comparing the summary's
+        # request, throttle and CPU time with its wall time shows whether the
+        # run was bound by latency, by the quota or by local work.
+        with self._lock:
+            endpoints = {name: dict(stats, latency_buckets=list(stats['latency_buckets']))
+                         for name, stats in self._endpoints.items()}
+            wall_time = time.perf_counter() - self._started
+            cpu_time = time.process_time() - self._cpu_started
+
+        for stats in endpoints.values():
+            stats['latency_mean'] = stats['latency_sum'] / stats['requests'] if stats['requests'] else 0.0
+        return {
+            'summary': {
+                'wall_time': wall_time,
+                'cpu_time': cpu_time,
+                'requests': sum(stats['requests'] for stats in endpoints.values()),
+                'cache_hits': sum(stats['cache_hits'] for stats in endpoints.values()),
+                'request_time': sum(stats['latency_sum'] for stats in endpoints.values()),
+                'throttle_sleep': sum(stats['throttle_sleep'] for stats in endpoints.values()),
+                'bytes_out': sum(stats['bytes_out'] for stats in endpoints.values()),
+                'bytes_in': sum(stats['bytes_in'] for stats in endpoints.values())
+            },
+            'latency_buckets': list(self._LATENCY_BUCKETS),
+            'endpoints': endpoints
+        }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=4, sort_keys=True)
+
+    def to_prometheus(self):
+        snapshot = self.snapshot()
+        lines = []
+
+        def metric(name, metric_type, help_text, samples):
+            lines.append('# HELP pydeez_{} {}'.format(name, help_text))
+            lines.append('# TYPE pydeez_{} {}'.format(name, metric_type))
+            for labels, value in samples:
+                lines.append('pydeez_{}{{{}}} {}'.format(name, self._labels(labels), value))
+
+        endpoints = sorted(snapshot['endpoints'].items())
+        for field, metric_type, help_text in (
+                ('requests', 'counter', 'HTTP requests sent'),
+                ('errors', 'counter', 'HTTP responses with an error status'),
+                ('cache_hits', 'counter', 'Requests answered from the response cache'),
+                ('retries', 'counter', 'Requests retried after a connection error or 5xx'),
+                ('quota_retries', 'counter', 'Requests retried after a quota error'),
+                ('bytes_out', 'counter', 'Bytes of request URLs and bodies sent'),
+                ('bytes_in', 'counter', 'Bytes of response bodies received'),
+                ('throttle_sleep', 'counter', 'Seconds spent waiting for the rate limiter')):
+            metric(field + ('_seconds_total' if field == 'throttle_sleep' else '_total'), metric_type, help_text,
+                   [((('endpoint', name),), stats[field]) for name, stats in endpoints])
+
+        histogram_samples = []
+        for name, stats in endpoints:
+            cumulative = 0
+            for upper_bound, count in zip(list(snapshot['latency_buckets']) + ['+Inf'], stats['latency_buckets']):
+                cumulative += count
+                histogram_samples.append(((('endpoint', name), ('le', upper_bound)), cumulative))
+        lines.append('# HELP pydeez_request_latency_seconds Time from sending a request to receiving its response')
+        lines.append('# TYPE pydeez_request_latency_seconds histogram')
+        for labels, value in histogram_samples:
+            lines.append('pydeez_request_latency_seconds_bucket{{{}}} {}'.format(self._labels(labels), value))
+        for name, stats in endpoints:
+            label_text = self._labels((('endpoint', name),))
+            lines.append('pydeez_request_latency_seconds_sum{{{}}} {}'.format(label_text, stats['latency_sum']))
+            lines.append('pydeez_request_latency_seconds_count{{{}}} {}'.format(label_text, stats['requests']))
+
+        for field, help_text in (('wall_time', 'Seconds since the metrics were reset'),
+                                 ('cpu_time', 'CPU seconds used by the process since the metrics were reset')):
+            lines.append('# HELP pydeez_run_{}_seconds {}'.format(field, help_text))
+            lines.append('# TYPE pydeez_run_{}_seconds gauge'.format(field))
+            lines.append('pydeez_run_{}_seconds {}'.format(field, snapshot['summary'][field]))
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _labels(labels):
+        return ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                        for key, value in labels)
+
+    def write(self, path):
+        # Prometheus text format for .prom/.txt files, JSON otherwise
+        text = self.to_prometheus() if path.endswith(('.prom', '.txt')) else self.to_json()
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    def print_summary(self):
+        summary = self.snapshot()['summary']
+        print('{requests} requests ({cache_hits} from cache) in {wall_time:.1f}s: {request_time:.1f}s waiting '
+              'on responses, {throttle_sleep:.1f}s throttled, {cpu_time:.1f}s CPU; '
+              '{bytes_out} bytes sent, {bytes_in} received'.format(**summary))
@@ -0,0 +1,44 @@
+from bisect import bisect_left
+from .playlist import Playlist
+
+
+class PlaylistIndex:
+    # Playlists sorted by title, so every playlist starting with a prefix is
+    # found with a binary search instead of a scan over the whole listing.
+    # Lookups return playlists in listing order.
+    _MAX_CHAR = chr(0x10ffff)
+
+    def __init__(self, playlists):
+        self._playlists = list(playlists)
+        # A stable sort keeps playlists with the same title in listing order
+        order = sorted(range(len(self._playlists)), key=lambda position: self._playlists[position].title)
+        self._titles = [self._playlists[position].title for position in order]
+        self._positions = order
+
+    @staticmethod
+    def from_dicts(raw_playlists):
+        return PlaylistIndex(Playlist.from_dict(raw_playlist) for raw_playlist in raw_playlists)
+
+    def __len__(self):
+        return len(self._playlists)
+
+    def __iter__(self):
+        return iter(self._playlists)
+
+    def with_prefix(self, prefix):
+        return self.with_prefixes([prefix])
+
+    def with_prefixes(self, prefixes):
+        positions = set()
+        for prefix in prefixes:
+            start = bisect_left(self._titles, prefix)
+            end = bisect_left(self._titles, prefix + self._MAX_CHAR, start)
+            positions.update(self._positions[start:end])
+        return [self._playlists[position] for position in sorted(positions)]
+
+    def by_title(self, title):
+        # The first playlist in the listing with exactly this title, or None
+        i = bisect_left(self._titles, title)
+        if i < len(self._titles) and self._titles[i] == title:
+            return self._playlists[self._positions[i]]
+        return None
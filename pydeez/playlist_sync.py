@@ -0,0 +1,44 @@
+def diff_playlist(current_ids, desired_ids):
+    # The tracks to remove and to add to turn current_ids into desired_ids,
+    # and whether the order still differs after that. Added tracks land at the
+    # end of a playlist, in the order they are added.
+    desired = set(desired_ids)
+    current = set(current_ids)
+    to_remove = [track_id for track_id in current_ids if track_id not in desired]
+    to_add = [track_id for track_id in desired_ids if track_id not in current]
+    order_after_writes = [track_id for track_id in current_ids if track_id in desired] + to_add
+    return to_remove, to_add, order_after_writes != list(desired_ids)
+
+
+def assign_sticky(track_ids, current_playlists, playlist_size):
+    # Splits track_ids into playlists of at most playlist_size, keeping every
+    # track in the playlist it is already in where possible, so a reshuffle
+    # mostly changes order rather than membership. Tracks that are new (or
+    # whose playlist is full) fill the remaining room in playlist order. Each
+    # playlist keeps the relative order the tracks have in track_ids.
+    playlist_count = max(1, -(-len(track_ids) // playlist_size))
+    location = {}
+    for index, playlist_ids in enumerate(current_playlists[:playlist_count]):
+        for track_id in playlist_ids:
+            location.setdefault(track_id, index)
+
+    assigned = [[] for _ in range(playlist_count)]
+    unplaced = []
+    for track_id in track_ids:
+        index = location.get(track_id)
+        if index is not None and len(assigned[index]) < playlist_size:
+            assigned[index].append(track_id)
+        else:
+            unplaced.append(track_id)
+
+    # Unplaced tracks go to the first playlists with room; merging by position
+    # in track_ids keeps every playlist in shuffled order
+    position = {track_id: i for i, track_id in enumerate(track_ids)}
+    next_unplaced = 0
+    for index, playlist_ids in enumerate(assigned):
+        room = playlist_size - len(playlist_ids)
+        if room > 0 and next_unplaced < len(unplaced):
+            playlist_ids.extend(unplaced[next_unplaced:next_unplaced + room])
+            next_unplaced += room
+            playlist_ids.sort(key=position.__getitem__)
+    return assigned
@@ -0,0 +1,116 @@
+import threading
+import requests
+from tqdm import tqdm as statusify
+
+
+class PlaylistWriter:
+    _DEFAULT_INITIAL_BATCH_SIZE = 50
+    _DEFAULT_MAX_BATCH_SIZE = 250
+    _MAX_REPAIR_ROUNDS = 2
+    _REPROBE_INTERVAL = 50
+    # Single tracks rejected in a row, before any batch was accepted, after
+    # which the playlist is taken to refuse every add
+    _MAX_REJECTIONS_WITHOUT_SUCCESS = 10
+
+    def __init__(self, pydeez, initial_batch_size=_DEFAULT_INITIAL_BATCH_SIZE,
+                 max_batch_size=_DEFAULT_MAX_BATCH_SIZE, verify_every=None):
+        self._pydeez = pydeez
+        self._batch_size = initial_batch_size
+        self._max_batch_size = max_batch_size
+        # Smallest batch size seen failing; forgotten again after a run of
+        # successes in case the failure was caused by a rejected track.
+        self._failed_batch_size = max_batch_size + 1
+        self._succeeded_batch_size = 0
+        self._successes = 0
+        self._verify_every = verify_every
+        # One writer may fill several playlists at once; they share what it learns about batch sizes
+        self._lock = threading.Lock()
+
+    @property
+    def batch_size(self):
+        return self._batch_size
+
+    def fill(self, playlist_id, track_ids, desc='Tracks in Playlist', position=None):
+        track_ids = [str(track_id) for track_id in track_ids]
+        if not self._add_all(playlist_id, track_ids, desc, position):
+            # Not a single batch was accepted, so re-adding the same tracks won't go any better
+            print('No tracks could be added to playlist {}'.format(playlist_id))
+            return track_ids
+        return self._repair(playlist_id, track_ids, position)
+
+    def _add_all(self, playlist_id, track_ids, desc, position=None):
+        # Returns the number of batches that were accepted
+        added_count = 0
+        batches_written = 0
+        batches_accepted = 0
+        rejected_tracks = 0
+        with statusify(total=len(track_ids), desc=desc, position=position) as status:
+            while added_count < len(track_ids):
+                batch = track_ids[added_count:added_count + self._batch_size]
+
+                if self._add_batch(playlist_id, batch):
+                    batches_accepted += 1
+                    with self._lock:
+                        self._grow(len(batch))
+                elif len(batch) > 1:
+                    # Too large, or a track in it was rejected: retry in smaller batches
+                    with self._lock:
+                        self._shrink(len(batch))
+                    continue
+                else:
+                    rejected_tracks += 1
+                    if not batches_accepted and rejected_tracks == self._MAX_REJECTIONS_WITHOUT_SUCCESS:
+                        print('The first {} tracks were each rejected; giving up on playlist {}'.format(
+                            rejected_tracks, playlist_id))
+                        break
+                    print('Track {} was rejected; will retry it after verification'.format(batch[0]))
+
+                added_count += len(batch)
+                batches_written += 1
+                status.update(len(batch))
+
+                if self._verify_every and batches_written % self._verify_every == 0:
+                    self._checkpoint(playlist_id, added_count)
+        return batches_accepted
+
+    def _grow(self, succeeded_batch_size):
+        self._succeeded_batch_size = max(self._succeeded_batch_size, succeeded_batch_size)
+        self._successes += 1
+        if self._successes % self._REPROBE_INTERVAL == 0:
+            self._failed_batch_size = self._max_batch_size + 1
+        # Double, but stay below the smallest size known to fail
+        self._batch_size = min(self._batch_size * 2, (self._batch_size + self._failed_batch_size) // 2)
+
+    def _shrink(self, failed_batch_size):
+        if failed_batch_size > self._succeeded_batch_size:
+            # Larger than anything accepted so far: fall back to the largest accepted size
+            self._failed_batch_size = min(self._failed_batch_size, failed_batch_size)
+            self._batch_size = max(1, self._succeeded_batch_size, failed_batch_size // 2)
+        else:
+            # A size that worked before failed, so narrow down on the rejected track
+            self._batch_size = max(1, failed_batch_size // 2)
+
+    def _add_batch(self, playlist_id, batch):
+        try:
+            return self._pydeez.add_tracks_to_playlist_by_track_ids(playlist_id, batch)
+        except requests.RequestException as e:
+            print('Error adding tracks: {}'.format(e))
+            return False
+
+    def _checkpoint(self, playlist_id, expected_count):
+        track_count = self._pydeez.get_playlist_by_id(playlist_id).track_count
+        if track_count < expected_count:
+            print('Checkpoint: {} of {} tracks are in the playlist so far'.format(track_count, expected_count))
+
+    def _repair(self, playlist_id, track_ids, position=None):
+        # Verify once against the playlist's actual contents and re-add only
+        # the tracks that are missing.
+        missing = track_ids
+        for repair_round in range(self._MAX_REPAIR_ROUNDS + 1):
+            present = {str(track.id) for track in self._pydeez.iter_tracks_for_playlist_id(playlist_id)}
+            missing = [track_id for track_id in track_ids if track_id not in present]
+            if not missing or repair_round == self._MAX_REPAIR_ROUNDS:
+                break
+            print('{} of the tracks were not added; re-adding them'.format(len(missing)))
+            self._add_all(playlist_id, missing, desc='Missing Tracks', position=position)
+        return missing
@@ -1,22 +1,41 @@
-import requests
 import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import chain
+import requests
+from .errors import DeezerApiError
 from .playlist import Playlist
+from .playlist_index import PlaylistIndex
+from .playlist_sync import assign_sticky, diff_playlist
+from .playlist_writer import PlaylistWriter
 from .track import Track
+from .track_table import TrackTable
+from .transport import shared_transport
 from tqdm import tqdm as statusify
-from time import sleep
 
 
 class PyDeez:
     _BASE_URL = 'http://api.deezer.com'
-    _MY_PLAYLISTS_URL = '{}{}'.format(_BASE_URL, '/user/me/playlists')
-    _PLAYLIST_URL = '{}/playlist/{{}}'.format(_BASE_URL)
-    _PLAYLIST_TRACKS_URL = '{}/tracks'.format(_PLAYLIST_URL)
-    _MY_FAVOURITES_URL = '{}{}'.format(_BASE_URL, '/user/me/tracks')
-    _TRACK_URL = '{}/track/{{}}'.format(_BASE_URL)
+    _MY_PLAYLISTS_PATH = '/user/me/playlists'
+    _PLAYLIST_PATH = '/playlist/{}'
+    _PLAYLIST_TRACKS_PATH = '{}/tracks'.format(_PLAYLIST_PATH)
+    _MY_FAVOURITES_PATH = '/user/me/tracks'
+    _TRACK_PATH = '/track/{}'
     _MAX_PLAYLIST_SIZE = 2000
-    _MAX_TRACKS_IN_URL = 10
+    _DEFAULT_PARALLEL_PLAYLISTS = 4
+    _DEFAULT_PARALLEL_DELETES = 4
+    # Write errors a smaller batch can get past: too many or malformed ids, or
+    # a track Deezer doesn't know. Any other error, like an expired token
+    # (300), a missing permission (200) or an exhausted quota (4), fails every
+    # batch alike and is raised as a DeezerApiError.
+    _BATCH_ERROR_CODES = frozenset({100, 500, 501, 800})
 
-    def __init__(self, access_token):
+    def __init__(self, access_token, transport=None, base_url=_BASE_URL):
+        self._transport = transport or shared_transport()
+        self._my_playlists_url = base_url + self._MY_PLAYLISTS_PATH
+        self._playlist_url = base_url + self._PLAYLIST_PATH
+        self._playlist_tracks_url = base_url + self._PLAYLIST_TRACKS_PATH
+        self._my_favourites_url = base_url + self._MY_FAVOURITES_PATH
+        self._track_url = base_url + self._TRACK_PATH
         self._request_params = {
             'access_token': access_token,
             'expires': 0,
@@ -24,85 +43,327 @@ class PyDeez:
         }
 
     def get_playlists(self, prefixes=None):
-        all_playlists = self._api_get(self._MY_PLAYLISTS_URL)['data']
+        return self._filter_playlists(list(self.iter_raw_playlists()), prefixes)
+
+    def iter_raw_playlists(self):
+        # Every page of the listing, not just the first
+        return chain.from_iterable(self.iter_pages(self._my_playlists_url))
 
+    def get_playlist_index(self):
+        # For answering several prefix or title lookups from one listing
+        return PlaylistIndex.from_dicts(self.iter_raw_playlists())
+
+    @staticmethod
+    def _filter_playlists(all_playlists, prefixes):
         if prefixes is None:
             return all_playlists
 
-        return [Playlist.from_dict(playlist) for playlist
-                in all_playlists
-                if playlist['title'].startswith(tuple(prefixes))]
+        return PlaylistIndex.from_dicts(all_playlists).with_prefixes(prefixes)
 
     def get_playlist_by_id(self, playlist_id):
-        return Playlist.from_dict(self._api_get(self._PLAYLIST_URL.format(playlist_id)))
+        return Playlist.from_dict(self._api_get(self._playlist_url.format(playlist_id)))
+
+    def get_favourite_tracks(self, as_table=False):
+        if as_table:
+            return TrackTable.from_pages(self.iter_pages(self._my_favourites_url))
+        return list(self.iter_favourite_tracks())
 
-    def get_favourite_tracks(self):
-        return self._get_all_pages(self._MY_FAVOURITES_URL,
-                                   lambda track: Track.from_dict(track))
+    def iter_favourite_tracks(self):
+        return self._iter_all_pages(self._my_favourites_url, Track.from_dict)
 
     def _api_get(self, url):
         return json.loads(
-            requests.get(url, params=self._request_params).text)
+            self._transport.get(url, params=self._request_params).text)
 
-    def get_tracks_for_playlists(self, playlists):
-        return self._flatten([self.get_tracks_for_playlist(playlist)
-                              for playlist
-                              in statusify(playlists, desc='Retrieving Playlist Tracks')])
+    def get_tracks_for_playlists(self, playlists, as_table=False):
+        if as_table:
+            return TrackTable.from_pages(chain.from_iterable(
+                self.iter_pages(self._playlist_tracks_url.format(playlist.id))
+                for playlist
+                in statusify(playlists, desc='Retrieving Playlist Tracks')))
+        return list(self.iter_tracks_for_playlists(playlists))
+
+    def iter_tracks_for_playlists(self, playlists):
+        return chain.from_iterable(self.iter_tracks_for_playlist(playlist)
+                                   for playlist
+                                   in statusify(playlists, desc='Retrieving Playlist Tracks'))
 
     @staticmethod
     def _flatten(list_of_lists):
         return [item for a_list in list_of_lists for item in a_list]
 
-    def get_tracks_for_playlist(self, playlist):
-        return self._get_all_pages(
-            self._PLAYLIST_TRACKS_URL.format(playlist.id),
-            lambda track: Track.from_dict(track))
+    def get_tracks_for_playlist(self, playlist, as_table=False):
+        if as_table:
+            return TrackTable.from_pages(self.iter_pages(self._playlist_tracks_url.format(playlist.id)))
+        return list(self.iter_tracks_for_playlist(playlist))
 
-    def _get_all_pages(self, url, from_dict):
-        page = self._api_get(url)
-        if 'next' not in page:
-            return [from_dict(page) for page in page['data']]
-        else:
-            return [from_dict(page) for page in statusify(page['data'], desc='{} pages'.format(url))] + \
-                   self._get_all_pages(page['next'], from_dict)
-    def create_playlists(self, tracks, new_playlist_name_prefix):
+    def iter_tracks_for_playlist(self, playlist):
+        return self.iter_tracks_for_playlist_id(playlist.id)
+
+    def iter_track_pages_for_playlist(self, playlist):
+        return self.iter_pages(self._playlist_tracks_url.format(playlist.id))
+
+    def iter_tracks_for_playlist_id(self, playlist_id):
+        return self._iter_all_pages(self._playlist_tracks_url.format(playlist_id), Track.from_dict)
+
+    def _iter_all_pages(self, url, from_dict):
+        return chain.from_iterable(self.iter_pages(url, from_dict))
+
+    def iter_pages(self, url, from_dict=None):
+        # The next page is requested in the background while the caller
+        # consumes the current one. Without from_dict the raw items are yielded.
+        with ThreadPoolExecutor(max_workers=1) as prefetcher:
+            next_page = prefetcher.submit(self._api_get, url)
+            while next_page is not None:
+                page = next_page.result()
+                next_page = prefetcher.submit(self._api_get, page['next']) if 'next' in page else None
+                yield page['data'] if from_dict is None else [from_dict(item) for item in page['data']]
+
+    def create_playlists(self, tracks, new_playlist_name_prefix, writer=None,
+                         max_parallel=_DEFAULT_PARALLEL_PLAYLISTS, journal=None, journal_meta=None):
         playlist_chunks = self.chunkify(tracks, self._MAX_PLAYLIST_SIZE)
+        return self.create_playlists_from_chunks(playlist_chunks, new_playlist_name_prefix, writer,
+                                                 chunk_count=len(playlist_chunks), max_parallel=max_parallel,
+                                                 journal=journal, journal_meta=journal_meta)
+
+    def create_playlists_from_chunks(self, chunks, new_playlist_name_prefix, writer=None, chunk_count=None,
+                                     max_parallel=_DEFAULT_PARALLEL_PLAYLISTS, journal=None, journal_meta=None):
+        planned = ((self._build_playlist_title(new_playlist_name_prefix, i), chunk) for i, chunk in enumerate(chunks))
+        return self.write_playlists(planned, writer, chunk_count, max_parallel,
+                                    journal, new_playlist_name_prefix, journal_meta)
+
+    def write_playlists(self, planned, writer=None, playlist_count=None, max_parallel=_DEFAULT_PARALLEL_PLAYLISTS,
+                        journal=None, job=None, journal_meta=None):
+        # planned yields (title, tracks) pairs and may be a lazy iterator;
+        # each playlist is created and written as soon as it arrives. Up to
+        # max_parallel playlists are filled at once, each by its own worker
+        # so its batches stay in order; the transport's rate limiter paces
+        # all of them together. With a journal, every step is recorded so
+        # resume_playlists can finish the job after a crash.
+        if journal is not None:
+            journal.begin(job, journal_meta)
+
+        def planned_playlists():
+            for i, (title, tracks) in enumerate(planned):
+                track_ids = self._track_ids(tracks)
+                if journal is not None:
+                    journal.record_planned(i, title, track_ids)
+                yield {'index': i, 'title': title, 'track_ids': track_ids, 'playlist_id': None, 'filled': False}
+
+        return self._write_planned_playlists(planned_playlists(), writer, playlist_count, max_parallel, journal)
+
+    def resume_playlists(self, journal, writer=None, max_parallel=_DEFAULT_PARALLEL_PLAYLISTS):
+        # Finishes the job a journal left unfinished: playlists that were
+        # never created are created, and ones created before the interruption
+        # only get the tracks that did not land. Returns None if there is
+        # nothing to resume.
+        job = journal.pending()
+        if job is None:
+            return None
 
-        for i, subplaylist in enumerate(playlist_chunks):
-            if i % 3 == 0:
-                print('Pausing for a minute; throttling for the Deezer API...')
-                sleep(60)
+        remaining = [playlist for playlist in job['playlists'] if not playlist['filled']]
+        print('Resuming {}: {} of {} playlists left'.format(job['job'], len(remaining), len(job['playlists'])))
+        return self._write_planned_playlists(job['playlists'], writer, len(job['playlists']), max_parallel, journal)
 
-            print('Creating Playlist: {}/{}'.format(i+1, len(playlist_chunks)))
-            new_subplaylist_title = self._build_playlist_title(new_playlist_name_prefix, i)
-            new_playlist_id = self.create_playlist(new_subplaylist_title)
+    def _write_planned_playlists(self, playlists, writer, playlist_count, max_parallel, journal):
+        writer = writer or PlaylistWriter(self)
+        playlist_ids = []
+        with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+            fills = {}
+            for playlist in playlists:
+                i = playlist['index']
+                playlist_ids.append(playlist['playlist_id'])
+                if playlist['filled']:
+                    continue
 
-            url_friendly_subplaylist_chunks = self.chunkify(subplaylist, self._MAX_TRACKS_IN_URL)
+                print('Creating Playlist: {}/{}'.format(i+1, playlist_count or '?'))
+                partially_filled = playlist['playlist_id'] is not None
+                if not partially_filled:
+                    playlist_ids[-1] = self.create_playlist(playlist['title'])
+                    if journal is not None:
+                        journal.record_created(i, playlist_ids[-1])
 
-            total_added_count = 0
-            for url_friendly_subplaylist_chunk in statusify(url_friendly_subplaylist_chunks, desc='Chunks of Playlist'):
-                url_friendly_ids = [str(track.id) for track in url_friendly_subplaylist_chunk]
-                self.add_tracks_to_playlist_by_track_ids(new_playlist_id, url_friendly_ids)
-                updated_playlist = self.get_playlist_by_id(new_playlist_id)
+                fill = executor.submit(self._fill_playlist, writer, playlist_ids[-1], playlist['track_ids'],
+                                       playlist['title'], i % max_parallel, journal, i, partially_filled)
+                fills[fill] = playlist['title']
+
+            for fill in as_completed(fills):
+                missing_ids = fill.result()
+                if missing_ids:
+                    print('Not all the tracks were added to {}: {}'.format(fills[fill], ','.join(missing_ids)))
+                    print('{} of the tracks were not added'.format(len(missing_ids)))
+
+        if journal is not None:
+            journal.record_done()
+        return playlist_ids
+
+    def _fill_playlist(self, writer, playlist_id, track_ids, title, position, journal, index, partially_filled):
+        if partially_filled:
+            # Created before an interruption; only add what did not land
+            present = {str(track.id) for track in self.iter_tracks_for_playlist_id(playlist_id)}
+            track_ids = [track_id for track_id in track_ids if str(track_id) not in present]
+        missing_ids = writer.fill(playlist_id, track_ids, desc=title, position=position) if track_ids else []
+        if journal is not None:
+            journal.record_filled(index, missing_ids)
+        return missing_ids
+
+    def sync_playlists(self, tracks, playlist_name_prefix, writer=None, sticky=True, reorder=True,
+                       max_parallel=_DEFAULT_PARALLEL_PLAYLISTS):
+        # Makes the playlists titled prefix-00, prefix-01, ... hold tracks in
+        # order, touching only what differs: missing playlists are created,
+        # surplus ones deleted, and existing ones get just the removals,
+        # additions and (if reorder) one reorder they need.
+        writer = writer or PlaylistWriter(self)
+        track_ids = self._track_ids(tracks)
+        managed = self._get_managed_playlists(playlist_name_prefix)
+        current_contents = [[track['id'] for page in self.iter_track_pages_for_playlist(playlist) for track in page]
+                            for playlist in managed]
+
+        if sticky:
+            desired_contents = assign_sticky(track_ids, current_contents, self._MAX_PLAYLIST_SIZE)
+        else:
+            desired_contents = self.chunkify(track_ids, self._MAX_PLAYLIST_SIZE)
 
-                expected_new_playlist_size = total_added_count + self._MAX_TRACKS_IN_URL
-                if updated_playlist.track_count != expected_new_playlist_size:
-                    print('Not all the tracks were added for chunk: {}'.format(','.join(url_friendly_ids)))
-                    track_missing_count = expected_new_playlist_size - updated_playlist.track_count
-                    print('{} of the tracks were not added'.format(track_missing_count))
-                total_added_count = updated_playlist.track_count
+        totals = {'created': 0, 'deleted': 0, 'removed': 0, 'added': 0, 'reordered': 0, 'failed': 0}
+        with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+            syncs = []
+            for i, desired_ids in enumerate(desired_contents):
+                if i < len(managed):
+                    playlist_id, current_ids = managed[i].id, current_contents[i]
+                else:
+                    playlist_id, current_ids = self.create_playlist(
+                        self._build_playlist_title(playlist_name_prefix, i)), []
+                    totals['created'] += 1
+                syncs.append(executor.submit(self.sync_playlist, playlist_id, desired_ids, current_ids,
+                                             writer, reorder))
+
+            for sync in syncs:
+                for operation, count in sync.result().items():
+                    totals[operation] += count
+
+        surplus_ids = [playlist.id for playlist in managed[len(desired_contents):]]
+        if surplus_ids:
+            deleted = self.delete_playlists_by_ids(surplus_ids, max_parallel, 'Deleting Surplus Playlists')
+            totals['deleted'] = sum(deleted.values())
+
+        print('Synced {} playlists: {created} created, {deleted} deleted, {removed} tracks removed, '
+              '{added} added, {reordered} playlists reordered, {failed} failed'.format(
+                  len(desired_contents), **totals))
+        return totals
+
+    def sync_playlist(self, playlist_id, desired_ids, current_ids=None, writer=None, reorder=True):
+        writer = writer or PlaylistWriter(self)
+        desired_ids = [str(track_id) for track_id in desired_ids]
+        if current_ids is None:
+            current_ids = [track.id for track in self.iter_tracks_for_playlist_id(playlist_id)]
+        current_ids = [str(track_id) for track_id in current_ids]
+
+        # Counts what actually happened; failed is 1 if any step of the sync failed
+        to_remove, to_add, needs_reorder = diff_playlist(current_ids, desired_ids)
+        not_removed = []
+        for batch in self.chunkify(to_remove, writer.batch_size):
+            if not self._remove_batch(playlist_id, batch):
+                not_removed.extend(batch)
+        if not_removed:
+            print('Could not remove {} tracks from playlist {}'.format(len(not_removed), playlist_id))
+
+        not_added = writer.fill(playlist_id, to_add, desc='Syncing Playlist {}'.format(playlist_id)) if to_add else []
+        if not_added:
+            print('Could not add {} tracks to playlist {}'.format(len(not_added), playlist_id))
+
+        reordered = False
+        if needs_reorder and reorder:
+            if not_removed:
+                # order has to list exactly the tracks in the playlist, which are unknown now
+                print('Not reordering playlist {} since removing tracks from it failed'.format(playlist_id))
+            else:
+                missing = set(not_added)
+                reordered = self.reorder_playlist(
+                    playlist_id, [track_id for track_id in desired_ids if track_id not in missing])
+                if not reordered:
+                    print('Could not reorder playlist {}'.format(playlist_id))
+
+        return {
+            'removed': len(to_remove) - len(not_removed),
+            'added': len(to_add) - len(not_added),
+            'reordered': int(reordered),
+            'failed': int(bool(not_removed or not_added or (needs_reorder and reorder and not reordered)))
+        }
+
+    def _remove_batch(self, playlist_id, batch):
+        try:
+            return self.remove_tracks_from_playlist_by_track_ids(playlist_id, batch)
+        except requests.RequestException as e:
+            print('Error removing tracks: {}'.format(e))
+            return False
+
+    def _get_managed_playlists(self, playlist_name_prefix):
+        # The playlists create_playlists would have made for this prefix, in
+        # index order, stopping at the first gap
+        playlists = PlaylistIndex(self.get_playlists(prefixes=[playlist_name_prefix]))
+        managed = []
+        playlist = playlists.by_title(self._build_playlist_title(playlist_name_prefix, 0))
+        while playlist is not None:
+            managed.append(playlist)
+            playlist = playlists.by_title(self._build_playlist_title(playlist_name_prefix, len(managed)))
+        return managed
+
+    @staticmethod
+    def _track_ids(tracks):
+        if isinstance(tracks, TrackTable):
+            return tracks.ids.tolist()
+        return [track.id if isinstance(track, Track) else track for track in tracks]
 
     def add_tracks_to_playlist_by_track_ids(self, playlist_id, track_ids):
-        requests.post(self._PLAYLIST_TRACKS_URL.format(playlist_id), params={
+        response = self._transport.post(self._playlist_tracks_url.format(playlist_id), params={
+            **self._request_params,
+            'songs': ','.join(track_ids)
+        })
+        self._invalidate_playlist(playlist_id)
+        return self._write_succeeded(response)
+
+    def remove_tracks_from_playlist_by_track_ids(self, playlist_id, track_ids):
+        response = self._transport.delete(self._playlist_tracks_url.format(playlist_id), params={
             **self._request_params,
             'songs': ','.join(track_ids)
         })
+        self._invalidate_playlist(playlist_id)
+        return self._write_succeeded(response)
+
+    def reorder_playlist(self, playlist_id, track_ids):
+        # order has to list every track in the playlist, up to 2000 ids, so it
+        # goes in the body rather than the URL
+        response = self._transport.post(self._playlist_tracks_url.format(playlist_id),
+                                        params=self._request_params,
+                                        data={'order': ','.join(track_ids)})
+        self._invalidate_playlist(playlist_id)
+        return self._write_succeeded(response)
+
+    def _invalidate_playlist(self, playlist_id):
+        # Cached listings carry each playlist's track count, and cached
+        # playlist pages its tracks; both are stale after a write.
+        self._transport.invalidate(self._playlist_url.format(playlist_id))
+        self._transport.invalidate(self._my_playlists_url)
+
+    def _write_succeeded(self, response):
+        error = DeezerApiError.from_response(response)
+        if error is not None and error.code not in self._BATCH_ERROR_CODES:
+            raise error
+        return self._is_success(response)
+
+    @staticmethod
+    def _is_success(response):
+        try:
+            return json.loads(response.text) is True
+        except ValueError:
+            return False
 
     def create_playlist(self, playlist_title):
-        response = requests.post(self._MY_PLAYLISTS_URL, params={
+        response = self._transport.post(self._my_playlists_url, params={
             **self._request_params,
             'title': playlist_title
         })
+        self._transport.invalidate(self._my_playlists_url)
         return json.loads(response.text)['id']
 
     @staticmethod
@@ -113,13 +374,32 @@ class PyDeez:
     def chunkify(a_list, sublist_size):
         return [a_list[i:i + sublist_size] for i in range(0, len(a_list), sublist_size)]
 
-    def delete_playlists(self, prefixes):
-        raw_playlists = self._api_get(self._MY_PLAYLISTS_URL)['data']
-        for raw_playlist in statusify(raw_playlists, 'Deleting Playlists If Starting With {}'.format(prefixes)):
-            playlist = Playlist.from_dict(raw_playlist)
-            if playlist.title.startswith(tuple(prefixes)):
-                self.delete_playlist_by_id(playlist.id)
+    def delete_playlists(self, prefixes, max_parallel=_DEFAULT_PARALLEL_DELETES):
+        playlists = self.get_playlists(prefixes=prefixes)
+        return self.delete_playlists_by_ids([playlist.id for playlist in playlists], max_parallel,
+                                            'Deleting Playlists Starting With {}'.format(prefixes))
+
+    def delete_playlists_by_ids(self, playlist_ids, max_parallel=_DEFAULT_PARALLEL_DELETES,
+                                desc='Deleting Playlists'):
+        # At most max_parallel deletes are in flight; the transport's rate
+        # limiter paces them. Returns {playlist_id: deleted} in input order.
+        results = {}
+        with ThreadPoolExecutor(max_workers=max_parallel) as executor, \
+                statusify(total=len(playlist_ids), desc=desc) as status:
+            futures = {executor.submit(self.delete_playlist_by_id, playlist_id): playlist_id
+                       for playlist_id in playlist_ids}
+            for future in as_completed(futures):
+                playlist_id = futures[future]
+                try:
+                    results[playlist_id] = future.result()
+                except Exception as e:
+                    print('Could not delete playlist {}: {}'.format(playlist_id, e))
+                    results[playlist_id] = False
+                status.update()
+        return {playlist_id: results[playlist_id] for playlist_id in playlist_ids}
 
     def delete_playlist_by_id(self, playlist_id):
-        requests.delete(self._PLAYLIST_URL.format(playlist_id), params={**self._request_params})
+        response = self._transport.delete(self._playlist_url.format(playlist_id), params={**self._request_params})
+        self._invalidate_playlist(playlist_id)
+        return self._is_success(response)
 
@@ -0,0 +1,90 @@
+import threading
+import time
+from urllib.parse import urlparse
+
+
+class TokenBucket:
+    _MAX_BACKOFF = 60
+    _RECOVERY_STEPS = 20
+
+    def __init__(self, rate, capacity):
+        self._max_rate = rate
+        self._rate = rate
+        self._min_rate = rate / 16
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0
+        self._consecutive_throttles = 0
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self):
+        return self._rate
+
+    def acquire(self):
+        # Each caller reserves a token, possibly taking the bucket below zero,
+        # and then sleeps outside the lock until its token would have arrived.
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            wait = max(self._blocked_until - now, 0, -self._tokens / self._rate)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def throttled(self):
+        # Multiplicative decrease plus an exponential pause on quota errors...
+        with self._lock:
+            self._consecutive_throttles += 1
+            self._rate = max(self._min_rate, self._rate / 2)
+            self._tokens = min(self._tokens, 0)
+            backoff = min(self._MAX_BACKOFF, 2 ** (self._consecutive_throttles - 1))
+            self._blocked_until = max(self._blocked_until, time.monotonic() + backoff)
+            return backoff
+
+    def succeeded(self):
+        # ...and additive increase back towards the configured rate.
+        with self._lock:
+            self._consecutive_throttles = 0
+            self._rate = min(self._max_rate, self._rate + self._max_rate / self._RECOVERY_STEPS)
+
+    def _refill(self, now):
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+
+class RateLimiter:
+    # (requests per second, burst) per host: Deezer allows 50 requests every
+    # 5 seconds, Last.fm asks for no more than 5 requests per second. Any
+    # window of t seconds can see up to burst + t * rate requests, so Deezer's
+    # limit is split into a burst of 25 and 5 requests per second.
+    _DEFAULT_LIMITS = {
+        'api.deezer.com': (5, 25),
+        'ws.audioscrobbler.com': (5, 5)
+    }
+    _DEFAULT_HOST_LIMIT = (10, 10)
+
+    def __init__(self, limits=None, default_limit=_DEFAULT_HOST_LIMIT):
+        self._limits = {**self._DEFAULT_LIMITS, **(limits or {})}
+        self._default_limit = default_limit
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, url):
+        return self._bucket(url).acquire()
+
+    def throttled(self, url):
+        return self._bucket(url).throttled()
+
+    def succeeded(self, url):
+        self._bucket(url).succeeded()
+
+    def _bucket(self, url):
+        host = urlparse(url).hostname
+        with self._lock:
+            if host not in self._buckets:
+                rate, capacity = self._limits.get(host, self._default_limit)
+                self._buckets[host] = TokenBucket(rate, capacity)
+            return self._buckets[host]
@@ -0,0 +1,167 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+import requests
+from requests.structures import CaseInsensitiveDict
+
+
+class CachedResponse:
+    def __init__(self, url, status_code, headers, body, expires_at):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+        self.expires_at = expires_at
+
+    @property
+    def is_fresh(self):
+        return time.time() < self.expires_at
+
+    @property
+    def validators(self):
+        validators = {}
+        if 'ETag' in self.headers:
+            validators['If-None-Match'] = self.headers['ETag']
+        if 'Last-Modified' in self.headers:
+            validators['If-Modified-Since'] = self.headers['Last-Modified']
+        return validators
+
+    def to_response(self):
+        response = requests.Response()
+        response.url = self.url
+        response.status_code = self.status_code
+        response.headers = CaseInsensitiveDict(self.headers)
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers) or 'utf-8'
+        response._content = self.body
+        return response
+
+
+class ResponseCache:
+    _SECRET_PARAMS = frozenset({'access_token', 'api_key'})
+    _DEFAULT_TTLS = (
+        (r'/user/me/playlists', 10 * 60),
+        (r'/playlist/\d+/tracks', 60 * 60),
+        (r'/playlist/\d+$', 10 * 60),
+        (r'/user/me/tracks', 60 * 60),
+        (r'method=user\.getrecenttracks', 5 * 60)
+    )
+    _DEFAULT_TTL = 10 * 60
+    _DEFAULT_MAX_ENTRIES = 20000
+    _DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+    _HEADERS_TO_KEEP = ('Content-Type', 'ETag', 'Last-Modified')
+
+    def __init__(self, path, ttls=_DEFAULT_TTLS, default_ttl=_DEFAULT_TTL,
+                 max_entries=_DEFAULT_MAX_ENTRIES, max_bytes=_DEFAULT_MAX_BYTES):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self._ttls = [(re.compile(pattern), ttl) for pattern, ttl in ttls]
+        self._default_ttl = default_ttl
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    status INTEGER NOT NULL,
+                    headers TEXT NOT NULL,
+                    body BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )''')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)')
+
+    def key(self, url, params=None):
+        # The URL with its query and the extra params merged and sorted, minus
+        # credentials, so the same resource maps to the same entry. The scheme
+        # is left out: Deezer's next links may be https while the URLs built
+        # from the base URL are http, and both must hit (and invalidate) the
+        # same entries.
+        _, netloc, path, query, _ = urlsplit(url)
+        all_params = parse_qsl(query) + [(name, str(value)) for name, value in (params or {}).items()]
+        public_params = sorted((name, value) for name, value in all_params if name not in self._SECRET_PARAMS)
+        return urlunsplit(('', netloc.lower(), path, urlencode(public_params), ''))
+
+    def ttl_for(self, key):
+        for pattern, ttl in self._ttls:
+            if pattern.search(key):
+                return ttl
+        return self._default_ttl
+
+    def get(self, key):
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT status, headers, body, expires_at FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            with self._connection:
+                self._connection.execute('UPDATE responses SET last_used = ? WHERE key = ?', (time.time(), key))
+        status, headers, body, expires_at = row
+        return CachedResponse(key, status, json.loads(headers), body, expires_at)
+
+    def store(self, key, response):
+        ttl = self.ttl_for(key)
+        if ttl <= 0:
+            return
+        headers = {name: response.headers[name] for name in self._HEADERS_TO_KEEP if name in response.headers}
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, response.status_code, json.dumps(headers), response.content, len(response.content),
+                 now + ttl, now))
+            self._evict()
+
+    def refresh(self, key):
+        with self._lock, self._connection:
+            now = time.time()
+            self._connection.execute('UPDATE responses SET expires_at = ?, last_used = ? WHERE key = ?',
+                                     (now + self.ttl_for(key), now, key))
+
+    def invalidate(self, url_prefix):
+        # Deletes the entries of the URL and of everything below it, matching
+        # whole path segments so /playlist/5 leaves /playlist/55 alone
+        prefix = self.key(url_prefix).rstrip('?')
+        escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        with self._lock, self._connection:
+            self._connection.execute(
+                "DELETE FROM responses WHERE key = ? OR key LIKE ? ESCAPE '\\' OR key LIKE ? ESCAPE '\\'",
+                (prefix, escaped + '/%', escaped + '?%'))
+
+    def clear(self):
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM responses')
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._connection.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+        return {'entries': entries, 'bytes': size}
+
+    def _evict(self):
+        # Least recently used entries go first once either limit is exceeded.
+        entries, size = self._connection.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+        if entries <= self._max_entries and size <= self._max_bytes:
+            return
+
+        excess_entries = entries - self._max_entries
+        excess_bytes = size - self._max_bytes
+        doomed = []
+        for key, entry_size in self._connection.execute('SELECT key, size FROM responses ORDER BY last_used'):
+            if excess_entries <= 0 and excess_bytes <= 0:
+                break
+            doomed.append((key,))
+            excess_entries -= 1
+            excess_bytes -= entry_size
+        self._connection.executemany('DELETE FROM responses WHERE key = ?', doomed)
+
+    def close(self):
+        self._connection.close()
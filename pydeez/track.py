@@ -3,11 +3,15 @@ from pydeez.artist import Artist
 
 
 class Track:
+    __slots__ = ('_id', '_artist', '_album', '_title', '_hash')
+
     def __init__(self, the_id, artist, album, title):
-        self._id = the_id
-        self._artist = artist
-        self._album = album
-        self._title = title
+        object.__setattr__(self, '_id', the_id)
+        object.__setattr__(self, '_artist', artist)
+        object.__setattr__(self, '_album', album)
+        object.__setattr__(self, '_title', title)
+        # Equality is by id, so the hash is too; computed once since tracks get hashed a lot
+        object.__setattr__(self, '_hash', hash(the_id))
 
     @property
     def id(self):
@@ -36,7 +40,7 @@ class Track:
 
     def __eq__(self, other):
         if isinstance(other, Track):
-            return self.id == other.id
+            return self._id == other._id
         raise NotImplementedError()
 
     @property
@@ -46,7 +50,16 @@ class Track:
         }
 
     def __hash__(self):
-        return hash(tuple(sorted(self.__dict__.items())))
+        return self._hash
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Track is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('Track is immutable')
+
+    def __reduce__(self):
+        return Track, (self._id, self._artist, self._album, self._title)
 
     def __repr__(self):
         return self.__str__()
@@ -0,0 +1,182 @@
+import numpy as np
+from .album import Album
+from .artist import Artist
+from .track import Track
+
+
+class _StringDictionary:
+    # Dictionary encoding: every distinct string is stored once and rows hold
+    # its integer code.
+
+    def __init__(self):
+        self.values = []
+        self._codes = {}
+
+    def encode(self, value):
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class TrackTable:
+    _ID_DTYPE = np.int64
+    _CODE_DTYPE = np.int32
+
+    def __init__(self, ids, artist_ids, album_ids, title_codes, artist_codes, album_codes,
+                 titles, artists, albums):
+        self._ids = ids
+        self._artist_ids = artist_ids
+        self._album_ids = album_ids
+        self._title_codes = title_codes
+        self._artist_codes = artist_codes
+        self._album_codes = album_codes
+        self._titles = titles
+        self._artists = artists
+        self._albums = albums
+
+    @staticmethod
+    def empty():
+        return TrackTable.from_dicts([])
+
+    @staticmethod
+    def from_dicts(raw_tracks):
+        return TrackTable.from_pages([raw_tracks])
+
+    @staticmethod
+    def from_pages(pages):
+        titles, artists, albums = _StringDictionary(), _StringDictionary(), _StringDictionary()
+        columns = ([], [], [], [], [], [])
+        ids, artist_ids, album_ids, title_codes, artist_codes, album_codes = columns
+        for page in pages:
+            for raw_track in page:
+                ids.append(raw_track['id'])
+                artist_ids.append(raw_track['artist'].get('id', 0))
+                album_ids.append(raw_track['album']['id'])
+                title_codes.append(titles.encode(raw_track['title']))
+                artist_codes.append(artists.encode(raw_track['artist']['name']))
+                album_codes.append(albums.encode(raw_track['album']['title']))
+        return TrackTable._from_columns(columns, titles.values, artists.values, albums.values)
+
+    @staticmethod
+    def from_tracks(tracks):
+        return TrackTable.from_dicts({
+            'id': track.id,
+            'title': track.title,
+            'artist': {'id': track._artist.id, 'name': track.artist},
+            'album': {'id': track._album.id, 'title': track.album}
+        } for track in tracks)
+
+    @staticmethod
+    def concat(tables):
+        tables = list(tables)
+        if not tables:
+            return TrackTable.empty()
+
+        # Re-encode each table's dictionary codes into one shared dictionary
+        titles, artists, albums = _StringDictionary(), _StringDictionary(), _StringDictionary()
+        title_codes, artist_codes, album_codes = [], [], []
+        for table in tables:
+            for codes, values, dictionary, output in ((table._title_codes, table._titles, titles, title_codes),
+                                                      (table._artist_codes, table._artists, artists, artist_codes),
+                                                      (table._album_codes, table._albums, albums, album_codes)):
+                recode = np.fromiter((dictionary.encode(value) for value in values),
+                                     dtype=TrackTable._CODE_DTYPE, count=len(values))
+                output.append(recode[codes])
+
+        return TrackTable(
+            np.concatenate([table._ids for table in tables]),
+            np.concatenate([table._artist_ids for table in tables]),
+            np.concatenate([table._album_ids for table in tables]),
+            np.concatenate(title_codes), np.concatenate(artist_codes), np.concatenate(album_codes),
+            titles.values, artists.values, albums.values
+        )
+
+    @staticmethod
+    def _from_columns(columns, titles, artists, albums):
+        ids, artist_ids, album_ids, title_codes, artist_codes, album_codes = columns
+        return TrackTable(
+            np.array(ids, dtype=TrackTable._ID_DTYPE),
+            np.array(artist_ids, dtype=TrackTable._ID_DTYPE),
+            np.array(album_ids, dtype=TrackTable._ID_DTYPE),
+            np.array(title_codes, dtype=TrackTable._CODE_DTYPE),
+            np.array(artist_codes, dtype=TrackTable._CODE_DTYPE),
+            np.array(album_codes, dtype=TrackTable._CODE_DTYPE),
+            titles, artists, albums
+        )
+
+    @property
+    def ids(self):
+        return self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self.to_tracks())
+
+    def __getitem__(self, selection):
+        # An int gives a Track; a slice, index array or boolean mask gives a TrackTable
+        if isinstance(selection, (int, np.integer)):
+            return self._track_at(selection)
+        return self.take(selection)
+
+    def take(self, selection):
+        return TrackTable(
+            self._ids[selection], self._artist_ids[selection], self._album_ids[selection],
+            self._title_codes[selection], self._artist_codes[selection], self._album_codes[selection],
+            self._titles, self._artists, self._albums
+        )
+
+    def unique(self):
+        # First occurrence of every id, in the original order
+        _, first_indices = np.unique(self._ids, return_index=True)
+        return self.take(np.sort(first_indices))
+
+    def difference(self, other):
+        return self.take(~np.isin(self._ids, self._other_ids(other)))
+
+    def intersection(self, other):
+        return self.take(np.isin(self._ids, self._other_ids(other)))
+
+    @staticmethod
+    def _other_ids(other):
+        if isinstance(other, TrackTable):
+            return other._ids
+        if isinstance(other, np.ndarray):
+            return other
+        return np.fromiter((track.id if isinstance(track, Track) else track for track in other),
+                           dtype=TrackTable._ID_DTYPE)
+
+    def filter_prefix(self, prefixes, column='title'):
+        codes, values = {
+            'title': (self._title_codes, self._titles),
+            'artist': (self._artist_codes, self._artists),
+            'album': (self._album_codes, self._albums)
+        }[column]
+        # Evaluated once per distinct string rather than once per row
+        prefixes = tuple(prefixes)
+        matching_values = np.fromiter((value.startswith(prefixes) for value in values), dtype=bool, count=len(values))
+        return self.take(matching_values[codes])
+
+    def permutation(self, rng=None):
+        rng = rng if rng is not None else np.random.default_rng()
+        return self.take(rng.permutation(len(self)))
+
+    def to_tracks(self):
+        return [self._track_at(i) for i in range(len(self))]
+
+    def _track_at(self, i):
+        return Track(
+            the_id=int(self._ids[i]),
+            artist=Artist.from_dict({'id': int(self._artist_ids[i]), 'name': self._artists[self._artist_codes[i]]}),
+            album=Album.from_dict({'id': int(self._album_ids[i]), 'title': self._albums[self._album_codes[i]]}),
+            title=self._titles[self._title_codes[i]]
+        )
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return 'TrackTable({} tracks)'.format(len(self))
@@ -0,0 +1,154 @@
+import json
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .rate_limit import RateLimiter
+
+
+class HttpTransport:
+    _DEFAULT_POOL_SIZE = 10
+    _DEFAULT_RETRIES = 3
+    _DEFAULT_BACKOFF_FACTOR = 0.5
+    _DEFAULT_TIMEOUT = 30
+    _RETRY_STATUSES = (500, 502, 503, 504)
+    # Writes are only retried when the connection could not be made, never
+    # after the server may already have applied them.
+    _IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'DELETE'})
+    _DEFAULT_QUOTA_RETRIES = 8
+    # Deezer reports an exceeded quota as error code 4 with a 200 status,
+    # Last.fm as error code 29.
+    _QUOTA_ERROR_CODES = frozenset({4, 29})
+
+    def __init__(self, pool_size=_DEFAULT_POOL_SIZE, retries=_DEFAULT_RETRIES,
+                 backoff_factor=_DEFAULT_BACKOFF_FACTOR, timeout=_DEFAULT_TIMEOUT,
+                 rate_limiter=None, quota_retries=_DEFAULT_QUOTA_RETRIES, cache=None, metrics=None):
+        self._timeout = timeout
+        self._cache = cache
+        self._metrics = metrics
+        self._rate_limiter = rate_limiter or RateLimiter()
+        self._quota_retries = quota_retries
+        self._adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=backoff_factor,
+                status_forcelist=self._RETRY_STATUSES,
+                allowed_methods=self._IDEMPOTENT_METHODS,
+                raise_on_status=False
+            )
+        )
+        self._session = requests.Session()
+        self._session.mount('http://', self._adapter)
+        self._session.mount('https://', self._adapter)
+
+    def get(self, url, params=None):
+        return self.request('GET', url, params)
+
+    def post(self, url, params=None, data=None):
+        # data is sent form-encoded in the body, for parameters too long for a URL
+        return self.request('POST', url, params, data)
+
+    def delete(self, url, params=None):
+        return self.request('DELETE', url, params)
+
+    def use_cache(self, cache):
+        self._cache = cache
+
+    def use_metrics(self, metrics):
+        # metrics gets record_request, record_cache_hit and record_quota_retry
+        # calls for every request; see RequestMetrics
+        self._metrics = metrics
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    def invalidate(self, url_prefix):
+        if self._cache is not None:
+            self._cache.invalidate(url_prefix)
+
+    def request(self, method, url, params=None, data=None):
+        if self._cache is None:
+            return self._send(method, url, params, data=data)
+
+        if method != 'GET':
+            response = self._send(method, url, params, data=data)
+            self._cache.invalidate(url)
+            return response
+
+        key = self._cache.key(url, params)
+        cached = self._cache.get(key)
+        if cached is not None and cached.is_fresh:
+            if self._metrics is not None:
+                self._metrics.record_cache_hit(method, url, params)
+            return cached.to_response()
+
+        response = self._send(method, url, params, cached.validators if cached is not None else None)
+        if cached is not None and response.status_code == 304:
+            self._cache.refresh(key)
+            return cached.to_response()
+        if response.status_code == 200 and not self._is_error_body(response):
+            self._cache.store(key, response)
+        return response
+
+    def _send(self, method, url, params, headers=None, data=None):
+        for attempt in range(self._quota_retries + 1):
+            throttle_sleep = self._rate_limiter.acquire(url)
+            started = time.perf_counter()
+            response = self._session.request(method, url, params=params, data=data, headers=headers,
+                                             timeout=self._timeout)
+            if self._metrics is not None:
+                self._metrics.record_request(method, url, params, response, time.perf_counter() - started,
+                                             throttle_sleep)
+            if not self._is_quota_exceeded(response):
+                self._rate_limiter.succeeded(url)
+                return response
+            if attempt < self._quota_retries:
+                if self._metrics is not None:
+                    self._metrics.record_quota_retry(method, url, params)
+                backoff = self._rate_limiter.throttled(url)
+                print('Quota exceeded; backing off for {}s before retrying {}'.format(backoff, url))
+        return response
+
+    @staticmethod
+    def _is_error_body(response):
+        return response.content.lstrip().startswith(b'{"error"')
+
+    @classmethod
+    def _is_quota_exceeded(cls, response):
+        if response.status_code == 429:
+            return True
+        if not cls._is_error_body(response):
+            return False
+        try:
+            error = json.loads(response.content)['error']
+        except ValueError:
+            return False
+        code = error.get('code') if isinstance(error, dict) else error
+        return code in cls._QUOTA_ERROR_CODES
+
+    def pool_stats(self):
+        pools = self._adapter.poolmanager.pools
+        connection_pools = [pools[key] for key in pools.keys()]
+        requests_sent = sum(pool.num_requests for pool in connection_pools)
+        connections_opened = sum(pool.num_connections for pool in connection_pools)
+        return {
+            'requests': requests_sent,
+            'connections': connections_opened,
+            'reused': requests_sent - connections_opened
+        }
+
+    def close(self):
+        self._session.close()
+
+
+_shared_transport = None
+
+
+def shared_transport():
+    global _shared_transport
+    if _shared_transport is None:
+        _shared_transport = HttpTransport()
+    return _shared_transport
@@ -1,31 +1,115 @@
+import argparse
+import os
+import queue
+import random
+from concurrent.futures import ThreadPoolExecutor
 from getpass import getpass
 from input_tool import get_input_list, yes_no_query
-from pydeez import PyDeez
-from random import sample
+import numpy as np
+from pydeez import JobJournal, PyDeez, RequestMetrics, ResponseCache, shared_transport
+
+_EXCLUDED_PREFIXES = ['favourite', 'nope']
+_PLAYLIST_SIZE = 2000
+_SHUFFLE_BUFFER_SIZE = 10000
+_JOURNAL_PATH = os.path.join('cache', 'randeezer_journal.jsonl')
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Randomize Deezer playlists.')
+    parser.add_argument('--pipelined', action='store_true',
+                        help='write the new playlists while the source playlists are still being read')
+    parser.add_argument('--shuffle-buffer', type=int, default=_SHUFFLE_BUFFER_SIZE,
+                        help='tracks held back for shuffling in pipelined mode (larger is more random)')
+    parser.add_argument('--sync', action='store_true',
+                        help='update existing playlists with the new prefix in place instead of recreating them')
+    parser.add_argument('--resume', action='store_true',
+                        help='finish writing the playlists of an interrupted run')
+    parser.add_argument('--metrics', metavar='PATH',
+                        help='write per-endpoint request metrics to PATH (Prometheus text for .prom, else JSON)')
+    args = parser.parse_args()
+    if args.pipelined and args.sync:
+        parser.error('--pipelined and --sync cannot be combined')
+
+    if args.metrics:
+        metrics = RequestMetrics()
+        shared_transport().use_metrics(metrics)
+        try:
+            run(args)
+        finally:
+            metrics.print_summary()
+            metrics.write(args.metrics)
+            print('Request metrics written to {}'.format(args.metrics))
+    else:
+        run(args)
+
+
+def run(args):
     print("Welcome to Randeezer! Let's randomize all your playlists!")
     print("")
     access_token = getpass("Let's start with your API access token: ")
 
+    shared_transport().use_cache(ResponseCache(os.path.join('cache', 'http_cache.sqlite')))
     pydeez = PyDeez(access_token)
+    journal = JobJournal(_JOURNAL_PATH)
+
+    if args.resume:
+        job = journal.pending()
+        if job is None:
+            print('There is no interrupted run to resume.')
+            return
+        pydeez.resume_playlists(journal)
+        ask_to_delete_playlists(pydeez, job['meta']['prefixes'], job['job'])
+        return
 
     print("Enter the prefixes of the playlists you want to include. Leave it empty when you're done:\n")
     prefixes = get_input_list()
 
-    tracks = randeezer(pydeez, prefixes)
+    if args.pipelined:
+        # Everything is asked up front, since writing starts while reading
+        remove_rated = yes_no_query('Should I remove tracks that were already rated?', default=False)
+        new_prefix = input("What is the prefix you'd like to use for the new playlists? ")
+        randeezer_pipelined(pydeez, prefixes, new_prefix,
+                            _EXCLUDED_PREFIXES if remove_rated else None, include_favourites=remove_rated,
+                            shuffle_buffer_size=args.shuffle_buffer)
+    else:
+        tracks = randeezer(pydeez, prefixes)
+
+        tracks = remove_tracks(pydeez, tracks, _EXCLUDED_PREFIXES, include_favourites=True)
+
+        new_prefix = input("What is the prefix you'd like to use for the new playlists? ")
+        if args.sync:
+            pydeez.sync_playlists(tracks, new_prefix)
+        else:
+            # Journaled, so an interrupted run can be finished with --resume
+            pydeez.create_playlists(tracks, new_prefix, journal=journal, journal_meta={'prefixes': prefixes})
+
+    ask_to_delete_playlists(pydeez, prefixes, new_prefix)
 
-    tracks = remove_tracks(pydeez, tracks, ['favourite', 'nope'], include_favourites=True)
 
-    new_prefix = input("What is the prefix you'd like to use for the new playlists? ")
-    pydeez.create_playlists(tracks, new_prefix)
+def overlaps_new_playlists(prefixes, new_prefix):
+    # Whether deleting the playlists starting with any of the prefixes would
+    # also delete the ones just written, titled new_prefix-00, new_prefix-01, ...
+    title_start = '{}-'.format(new_prefix)
+    return any(title_start.startswith(prefix) or
+               (prefix.startswith(title_start) and prefix[len(title_start):].isdigit())
+               for prefix in prefixes)
+
+
+def ask_to_delete_playlists(pydeez, prefixes, new_prefix):
+    if overlaps_new_playlists(prefixes, new_prefix):
+        print('Not deleting the old playlists: the new playlists titled {}-NN start with one of {}'.format(
+            new_prefix, prefixes))
+        return
 
     proceed_with_deletions = yes_no_query('Would you like to delete the old playlists with the prefixes: {}'.
                                           format(prefixes), default=False)
 
     if proceed_with_deletions:
-        pydeez.delete_playlists(prefixes=prefixes)
+        results = pydeez.delete_playlists(prefixes=prefixes)
+        failed_ids = [playlist_id for playlist_id, deleted in results.items() if not deleted]
+        print('Deleted {} of {} playlists'.format(len(results) - len(failed_ids), len(results)))
+        if failed_ids:
+            print('Could not delete: {}'.format(failed_ids))
 
 
 def randeezer(pydeez, prefixes):
@@ -36,27 +120,139 @@ def randeezer(pydeez, prefixes):
     print('Total Number of Tracks: {}'.format(
         sum([playlist.track_count for playlist in playlists])))
 
-    tracks = pydeez.get_tracks_for_playlists(playlists)
+    tracks = pydeez.get_tracks_for_playlists(playlists, as_table=True)
     print('Total Number of Tracks Received: {}'.format(len(tracks)))
 
     print('Randomizing tracks...')
-    return sample(list(set(tracks)), len(list(set(tracks))))
+    return tracks.unique().permutation()
 
 
 def remove_tracks(pydeez, tracks, prefixes, include_favourites):
-    tracks_to_remove = set()
+    tables_to_remove = []
     if include_favourites:
-        tracks_to_remove.update(pydeez.get_favourite_tracks())
+        tables_to_remove.append(pydeez.get_favourite_tracks(as_table=True))
 
     playlists_to_remove = pydeez.get_playlists(prefixes=prefixes)
-    tracks_to_remove.update(pydeez.get_tracks_for_playlists(playlists_to_remove))
+    tables_to_remove.append(pydeez.get_tracks_for_playlists(playlists_to_remove, as_table=True))
+    ids_to_remove = np.concatenate([table.ids for table in tables_to_remove])
 
-    tracks_to_be_pruned = list((set(tracks) & tracks_to_remove))
+    tracks_to_be_pruned = tracks.intersection(ids_to_remove)
     proceed_remove_tracks = yes_no_query('I found {} tracks that were already rated. Should I remove them?'.
                                          format(len(tracks_to_be_pruned)),
                                          default=False)
 
-    return list((set(tracks) - tracks_to_remove)) if proceed_remove_tracks else tracks
+    return tracks.difference(ids_to_remove) if proceed_remove_tracks else tracks
+
+
+def randeezer_pipelined(pydeez, prefixes, new_prefix, exclude_prefixes=None, include_favourites=False,
+                        shuffle_buffer_size=_SHUFFLE_BUFFER_SIZE, rng=None):
+    # Reads the source playlists page by page and writes each full playlist
+    # chunk while the remaining pages are still being read. The tracks to
+    # exclude are fetched concurrently; source tracks are held back until
+    # they have arrived.
+    #
+    # Shuffling goes through a buffer of shuffle_buffer_size tracks, and each
+    # output track is drawn uniformly from it. This is only a uniform
+    # permutation when the buffer holds every track (and then nothing is
+    # written before reading finishes). With a smaller buffer a track read
+    # late can't land in an early playlist. The source playlists are read in
+    # random order, so which tracks those are is itself random.
+    rng = rng or random.Random()
+    print("Getting all the playlists that start with {}:".format(prefixes))
+    playlists = pydeez.get_playlists(prefixes=prefixes)
+    rng.shuffle(playlists)
+    print([playlist.title for playlist in playlists])
+    print('Total Number of Tracks: {}'.format(sum(playlist.track_count for playlist in playlists)))
+
+    chunks = queue.Queue()
+    stats = {'read': 0, 'excluded': 0, 'written': 0}
+
+    def read_tracks():
+        try:
+            track_ids = _stream_new_track_ids(pydeez, playlists, excluded_ids, stats)
+            chunk = []
+            for track_id in _shuffle_buffered(track_ids, shuffle_buffer_size, rng):
+                chunk.append(track_id)
+                if len(chunk) == _PLAYLIST_SIZE:
+                    chunks.put(chunk)
+                    chunk = []
+            if chunk:
+                chunks.put(chunk)
+        finally:
+            chunks.put(None)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        excluded_ids = executor.submit(_fetch_excluded_ids, pydeez, exclude_prefixes, include_favourites)
+        reader = executor.submit(read_tracks)
+
+        def counted(chunk_iterator):
+            for chunk in chunk_iterator:
+                stats['written'] += len(chunk)
+                yield chunk
+
+        pydeez.create_playlists_from_chunks(counted(iter(chunks.get, None)), new_prefix)
+        reader.result()
+
+    print('Tracks read: {}, already rated: {}, written: {}'.format(
+        stats['read'], stats['excluded'], stats['written']))
+
+
+def _fetch_excluded_ids(pydeez, exclude_prefixes, include_favourites):
+    excluded_ids = set()
+    if include_favourites:
+        excluded_ids.update(pydeez.get_favourite_tracks(as_table=True).ids.tolist())
+    if exclude_prefixes:
+        playlists_to_remove = pydeez.get_playlists(prefixes=exclude_prefixes)
+        excluded_ids.update(pydeez.get_tracks_for_playlists(playlists_to_remove, as_table=True).ids.tolist())
+    return excluded_ids
+
+
+def _stream_new_track_ids(pydeez, playlists, excluded_ids_future, stats):
+    # Yields every distinct, not excluded track id as the pages arrive
+    seen_ids = set()
+    pending_ids = []
+    excluded_ids = None
+    for playlist in playlists:
+        for page in pydeez.iter_track_pages_for_playlist(playlist):
+            for raw_track in page:
+                stats['read'] += 1
+                if raw_track['id'] not in seen_ids:
+                    seen_ids.add(raw_track['id'])
+                    pending_ids.append(raw_track['id'])
+
+            if excluded_ids is None and excluded_ids_future.done():
+                excluded_ids = excluded_ids_future.result()
+            if excluded_ids is not None:
+                yield from _without_excluded(pending_ids, excluded_ids, stats)
+                pending_ids = []
+
+    if excluded_ids is None:
+        excluded_ids = excluded_ids_future.result()
+    yield from _without_excluded(pending_ids, excluded_ids, stats)
+
+
+def _without_excluded(track_ids, excluded_ids, stats):
+    for track_id in track_ids:
+        if track_id in excluded_ids:
+            stats['excluded'] += 1
+        else:
+            yield track_id
+
+
+def _shuffle_buffered(items, buffer_size, rng):
+    # Once the buffer is full, every new item replaces a uniformly chosen
+    # buffered one, which is emitted; the rest is shuffled at the end.
+    buffer_size = max(1, buffer_size)
+    buffer = []
+    for item in items:
+        if len(buffer) < buffer_size:
+            buffer.append(item)
+            continue
+        i = rng.randrange(buffer_size)
+        buffer[i], item = item, buffer[i]
+        yield item
+    rng.shuffle(buffer)
+    yield from buffer
 
 
 if __name__ == "__main__":
@@ -0,0 +1,198 @@
+import json
+import os
+import sqlite3
+from typing import Iterable, Optional, Set
+
+
+class ScrobbleStore:
+    """Local SQLite store of scrobbles, indexed by timestamp and normalized track key."""
+
+    def __init__(self, path: str):
+        """
+        Open (or create) a scrobble store.
+
+        Args:
+            path: Path of the SQLite database file
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS scrobbles (
+                    played_at INTEGER NOT NULL,
+                    track_key TEXT NOT NULL,
+                    artist TEXT NOT NULL,
+                    track TEXT NOT NULL,
+                    PRIMARY KEY (track_key, played_at)
+                ) WITHOUT ROWID''')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS scrobbles_played_at ON scrobbles (played_at)')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)')
+
+    @staticmethod
+    def track_key(artist_name: str, track_name: str) -> str:
+        """
+        Build the normalized key scrobbles of the same track share.
+
+        Args:
+            artist_name: Name of the artist
+            track_name: Name of the track
+
+        Returns:
+            The lowercased "artist - track" string
+        """
+        return f"{artist_name} - {track_name}".lower()
+
+    def __len__(self):
+        return self._connection.execute('SELECT COUNT(*) FROM scrobbles').fetchone()[0]
+
+    def add(self, scrobbles: Iterable[tuple]) -> int:
+        """
+        Add scrobbles, ignoring ones already stored.
+
+        Args:
+            scrobbles: Iterable of (timestamp, artist, track) tuples
+
+        Returns:
+            Number of scrobbles that were new
+        """
+        rows = ((played_at, self.track_key(artist_name, track_name), artist_name, track_name)
+                for played_at, artist_name, track_name in scrobbles)
+        with self._connection:
+            before = self._connection.total_changes
+            self._connection.executemany('INSERT OR IGNORE INTO scrobbles VALUES (?, ?, ?, ?)', rows)
+            return self._connection.total_changes - before
+
+    def replace(self, rows: Iterable[tuple]) -> int:
+        """
+        Replace every stored scrobble in one transaction, so readers never see a partial import.
+
+        Args:
+            rows: Iterable of (timestamp, track key, artist, track) tuples with keys built by track_key
+
+        Returns:
+            Number of distinct scrobbles stored
+        """
+        # Rows are streamed straight into SQLite, so an import never holds them all in memory
+        with self._connection:
+            self._connection.execute('DELETE FROM scrobbles')
+            # Building the played_at index once afterwards is faster than updating it on every insert
+            self._connection.execute('DROP INDEX IF EXISTS scrobbles_played_at')
+            before = self._connection.total_changes
+            self._connection.executemany('INSERT OR IGNORE INTO scrobbles VALUES (?, ?, ?, ?)', rows)
+            inserted = self._connection.total_changes - before
+            self._connection.execute('CREATE INDEX scrobbles_played_at ON scrobbles (played_at)')
+            return inserted
+
+    def prune(self, before: int) -> int:
+        """
+        Delete scrobbles older than a timestamp.
+
+        Args:
+            before: Unix timestamp; scrobbles played earlier are removed
+
+        Returns:
+            Number of scrobbles removed
+        """
+        with self._connection:
+            return self._connection.execute('DELETE FROM scrobbles WHERE played_at < ?', (before,)).rowcount
+
+    def clear(self):
+        with self._connection:
+            self._connection.execute('DELETE FROM scrobbles')
+            self._connection.execute('DELETE FROM meta')
+
+    def tracks_played_since(self, since: Optional[int] = None) -> Set[str]:
+        """
+        Get every track played at or after a timestamp.
+
+        Args:
+            since: Unix timestamp, or None for all stored scrobbles
+
+        Returns:
+            A set of "artist - track" strings, one per normalized track
+        """
+        rows = self._connection.execute(
+            'SELECT MIN(artist), MIN(track) FROM scrobbles WHERE played_at >= ? GROUP BY track_key',
+            (since if since is not None else -2 ** 63,))
+        return {f"{artist_name} - {track_name}" for artist_name, track_name in rows}
+
+    def track_keys_played_since(self, since: Optional[int] = None) -> Set[str]:
+        """
+        Get the normalized keys of every track played at or after a timestamp.
+
+        Args:
+            since: Unix timestamp, or None for all stored scrobbles
+
+        Returns:
+            A set of lowercased "artist - track" keys
+        """
+        rows = self._connection.execute(
+            'SELECT DISTINCT track_key FROM scrobbles WHERE played_at >= ?',
+            (since if since is not None else -2 ** 63,))
+        return {track_key for track_key, in rows}
+
+    def track_keys_last_played_before(self, before: int) -> Set[str]:
+        """
+        Get the keys of the tracks whose most recent scrobble is older than a timestamp.
+
+        Args:
+            before: Unix timestamp
+
+        Returns:
+            A set of normalized track keys
+        """
+        rows = self._connection.execute(
+            'SELECT track_key FROM scrobbles GROUP BY track_key HAVING MAX(played_at) < ?', (before,))
+        return {track_key for track_key, in rows}
+
+    def last_played(self, artist_name: str, track_name: str) -> Optional[int]:
+        """
+        Get when a track was last played.
+
+        Args:
+            artist_name: Name of the artist
+            track_name: Name of the track
+
+        Returns:
+            Unix timestamp of the most recent scrobble, or None if never played
+        """
+        return self._connection.execute(
+            'SELECT MAX(played_at) FROM scrobbles WHERE track_key = ?',
+            (self.track_key(artist_name, track_name),)).fetchone()[0]
+
+    def play_count(self, artist_name: str, track_name: str, since: int = None, until: int = None) -> int:
+        """
+        Count the plays of a track in a time window.
+
+        Args:
+            artist_name: Name of the artist
+            track_name: Name of the track
+            since: Start of the window (inclusive), or None for no lower bound
+            until: End of the window (exclusive), or None for no upper bound
+
+        Returns:
+            Number of scrobbles of the track in the window
+        """
+        return self._connection.execute(
+            'SELECT COUNT(*) FROM scrobbles WHERE track_key = ? AND played_at >= ? AND played_at < ?',
+            (self.track_key(artist_name, track_name),
+             since if since is not None else -2 ** 63,
+             until if until is not None else 2 ** 63 - 1)).fetchone()[0]
+
+    def get_meta(self, name: str, default=None):
+        row = self._connection.execute('SELECT value FROM meta WHERE name = ?', (name,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, name: str, value):
+        with self._connection:
+            if value is None:
+                self._connection.execute('DELETE FROM meta WHERE name = ?', (name,))
+            else:
+                self._connection.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (name, json.dumps(value)))
+
+    def close(self):
+        self._connection.close()